@@ -1,10 +1,205 @@
 import json
 import os
-from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import uuid
+from datetime import datetime
+from db import get_connection, release_connection, dict_cursor
+from response import columnar, wants_columnar, dumps, negotiated_compression
+from tracing import traced
+from blob_store import store_preview
+from inference import NO_VIOLATION, KnnModel, build_model, classify_materials
+from model_store import MODEL_REGISTRY_HOT, MODEL_REGISTRY_SIZE, ModelRegistry, get_model_store
+from training import cross_validate, extract_features, incremental_update, tombstones_pruned
+from jobs import enqueue, get_job, request_cancel, serialize_job
+from purge import purge_batch
+
+KNN_NEIGHBOURS = int(os.environ.get('KNN_NEIGHBOURS', '5'))
+BATCH_PROCESS_CHUNK = int(os.environ.get('BATCH_PROCESS_CHUNK', '500'))
+BATCH_RESULT_SAMPLE = 100
+
+model_store = get_model_store()
+model_registry = ModelRegistry(model_store, MODEL_REGISTRY_HOT, MODEL_REGISTRY_SIZE)
+_latest = {'state_version': None, 'model_version': None, 'live': None}
+
+def resolve_model(cursor, requested: str) -> dict:
+    '''Явная версия берётся из реестра артефактов. 'latest' — последний сохранённый артефакт; он ищется заново,
+    только когда сдвинулась версия ai_model_state_version. Пока артефактов нет, модель строится по текущей разметке'''
+    if requested != 'latest':
+        return model_registry.get(requested)
+    cursor.execute('SELECT last_value FROM ai_model_state_version')
+    state_version = cursor.fetchone()['last_value']
+    if _latest['state_version'] != state_version:
+        artifact_key = latest_artifact(cursor)
+        live = None if artifact_key else {'version': 'latest', **build_model(cursor, k=KNN_NEIGHBOURS)}
+        _latest.update(state_version=state_version, model_version=artifact_key, live=live)
+    if _latest['model_version'] is None:
+        return _latest['live']
+    return model_registry.get(_latest['model_version'])
+
+def latest_artifact(cursor):
+    cursor.execute('''
+        SELECT artifact_key FROM ai_training_metrics
+        WHERE artifact_key IS NOT NULL
+        ORDER BY training_date DESC
+        LIMIT 1
+    ''')
+    row = cursor.fetchone()
+    return row['artifact_key'] if row else None
+
+def train_model(conn, options: dict, progress=None) -> tuple:
+    '''Полное обучение или, при options['incremental'], дообучение базовой версии (по умолчанию последней)
+    разметками после её водяного знака. Выполняется воркером очереди (worker.py); progress(доля, сообщение)
+    вызывается по этапам и после каждой прочитанной порции. Возвращает (HTTP-статус, тело ответа)'''
+    progress = progress or (lambda fraction, message=None: None)
+    on_chunk = lambda read: progress(0.1, f'Прочитано разметок: {read}')
+    cursor = dict_cursor(conn)
+    base_version = None
+    if options.get('incremental'):
+        base_version = options.get('base_version') or latest_artifact(cursor)
+        if not base_version:
+            return 400, {'error': 'No trained model to update, run a full training first'}
+        try:
+            base = model_store.load(base_version)
+        except (FileNotFoundError, ValueError):
+            return 404, {'error': f'Model version not found: {base_version}'}
+        if base['watermark'] is None or base['material_ids'] is None:
+            return 409, {'error': f'Model {base_version} has no watermark, run a full training first'}
+        if tombstones_pruned(conn, base['watermark']):
+            return 409, {'error': f'Deletions since model {base_version} were pruned, run a full training first'}
+        training_set = incremental_update(conn, base, on_chunk=on_chunk)
+    else:
+        training_set = extract_features(conn, on_chunk=on_chunk)
+    
+    samples = len(training_set['label_ids'])
+    if samples < 10:
+        return 400, {
+            'error': 'Insufficient training data',
+            'message': f'Need at least 10 samples, have {samples}'
+        }
+    
+    progress(0.5, f'Кросс-валидация на {samples} образцах')
+    metrics = cross_validate(training_set['features'], training_set['label_ids'], training_set['classes'], KNN_NEIGHBOURS)
+    progress(0.9, 'Сохранение модели')
+    model = KnnModel.fit_encoded(training_set['features'], training_set['label_ids'], training_set['classes'], KNN_NEIGHBOURS)
+    model_version = f'v{datetime.now().strftime("%Y%m%d_%H%M%S_%f")}'
+    watermark = training_set['watermark'] or [None, 0]
+    artifact_key = model_store.save(model_version, model, training_set['notes'], samples,
+                                    training_set['material_ids'], watermark)
+    
+    cursor.execute('''
+        INSERT INTO ai_training_metrics 
+        (model_version, accuracy, precision_score, recall_score, f1_score, training_samples_count, notes,
+         artifact_key, code_metrics, base_version, watermark_updated_at, watermark_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    ''', (
+        model_version,
+        metrics['accuracy'],
+        metrics['precision'],
+        metrics['recall'],
+        metrics['f1_score'],
+        samples,
+        f'Trained on {samples} samples, {metrics["folds"]}-fold CV on {metrics["evaluated"]}',
+        artifact_key,
+        json.dumps(metrics['per_code'], ensure_ascii=False),
+        base_version,
+        watermark[0],
+        watermark[1]
+    ))
+    metric_id = cursor.fetchone()['id']
+    conn.commit()
+    cursor.close()
+    
+    result = {
+        'success': True,
+        'model_version': model_version,
+        'artifact_key': artifact_key,
+        'metric_id': metric_id,
+        'training_samples': samples,
+        'mode': 'incremental' if base_version else 'full',
+        'metrics': metrics
+    }
+    if base_version:
+        result.update(base_version=base_version, changed=training_set['changed'], removed=training_set['removed'])
+    return 200, result
+
+def batch_process(conn, limit: int, progress=None) -> dict:
+    '''Предсказания для ещё не обработанных pending-материалов порциями по BATCH_PROCESS_CHUNK. Порция блокируется
+    FOR UPDATE SKIP LOCKED и фиксируется вместе с предсказаниями, поэтому параллельные задачи не берут одни и те же
+    материалы. В результат попадают первые BATCH_RESULT_SAMPLE предсказаний'''
+    from psycopg2.extras import execute_values
+    cursor = dict_cursor(conn)
+    state = resolve_model(cursor, 'latest')
+    processed, count = [], 0
+    while count < limit:
+        cursor.execute('''
+            SELECT id, file_name, preview_url 
+            FROM materials 
+            WHERE status = 'pending'
+            AND NOT EXISTS (
+                SELECT 1 FROM ai_training_data 
+                WHERE material_id = materials.id
+            )
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ''', (min(BATCH_PROCESS_CHUNK, limit - count),))
+        materials = cursor.fetchall()
+        if not materials:
+            break
+        
+        classified = classify_materials(cursor, state['model'], [material['id'] for material in materials])
+        processed_at = datetime.now().isoformat()
+        rows = []
+        for material in materials:
+            prediction = prediction_from(state, classified[material['id']])
+            rows.append((
+                material['id'],
+                0,
+                state['version'],
+                json.dumps(prediction),
+                json.dumps({'source': 'batch_process', 'processed_at': processed_at})
+            ))
+            if len(processed) < BATCH_RESULT_SAMPLE:
+                processed.append({
+                    'material_id': material['id'],
+                    'file_name': material['file_name'],
+                    'prediction': prediction
+                })
+        execute_values(cursor, '''
+            INSERT INTO ai_training_data 
+            (material_id, markup_id, model_version, prediction_result, features)
+            VALUES %s
+        ''', rows, page_size=len(rows))
+        conn.commit()
+        count += len(materials)
+        if progress:
+            progress(count / limit, f'Обработано материалов: {count} из {limit}')
+    
+    cursor.close()
+    return {
+        'success': True,
+        'processed_count': count,
+        'model_version': state['version'],
+        'materials': processed
+    }
+
+def prediction_from(state: dict, classification: dict) -> dict:
+    label = classification['label']
+    has_violation = label is not None and label != NO_VIOLATION
+    return {
+        'has_violation': has_violation,
+        'confidence': round(classification['share'], 4) if label is not None else 0.5,
+        'violation_code': label if has_violation else None,
+        'violation_type': (state['notes'].get(label) or f'Нарушение {label}') if has_violation else None,
+        'neighbours': classification['support'],
+        'detected_objects': [
+            {'type': region['name'], 'bbox': [float(region['x']), float(region['y']), float(region['width']), float(region['height'])]}
+            for region in classification['regions']
+        ]
+    }
 
+@traced
+@negotiated_compression
 def handler(event: dict, context) -> dict:
     '''API для обучения ИИ модели распознавания нарушений'''
     method = event.get('httpMethod', 'GET')
@@ -29,8 +224,8 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        conn = get_connection()
+        cursor = dict_cursor(conn)
         
         if method == 'GET':
             action = event.get('queryStringParameters', {}).get('action', 'metrics')
@@ -43,6 +238,14 @@ def handler(event: dict, context) -> dict:
                 ''')
                 metrics = cursor.fetchall()
                 
+                if wants_columnar(event):
+                    names = [column.name for column in cursor.description]
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': dumps({'metrics': columnar(names, metrics)})
+                    }
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -67,6 +270,14 @@ def handler(event: dict, context) -> dict:
                 ''')
                 training_data = cursor.fetchall()
                 
+                if wants_columnar(event):
+                    names = [column.name for column in cursor.description]
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': dumps({'training_data': columnar(names, training_data)})
+                    }
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -125,85 +336,37 @@ def handler(event: dict, context) -> dict:
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({'history': [dict(h) for h in history]}, default=str)
                 }
-        
-        elif method == 'POST':
-            data = json.loads(event.get('body', '{}'))
-            action = data.get('action')
             
-            if action == 'train-model':
-                cursor.execute('''
-                    SELECT 
-                        m.id,
-                        vm.violation_code,
-                        vm.notes,
-                        json_agg(
-                            json_build_object(
-                                'x', mr.x,
-                                'y', mr.y,
-                                'width', mr.width,
-                                'height', mr.height,
-                                'label', mr.label,
-                                'type', mr.region_type
-                            )
-                        ) as regions
-                    FROM materials m
-                    JOIN violation_markups vm ON m.id = vm.material_id
-                    LEFT JOIN markup_regions mr ON m.id = mr.material_id
-                    WHERE vm.is_training_data = TRUE
-                    GROUP BY m.id, vm.violation_code, vm.notes
-                ''')
-                training_samples = cursor.fetchall()
+            elif action == 'job-status':
+                job_id = event.get('queryStringParameters', {}).get('job_id', '')
+                job = get_job(conn, int(job_id)) if job_id.isdigit() else None
                 
-                if len(training_samples) < 10:
+                if not job:
                     return {
-                        'statusCode': 400,
+                        'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'error': 'Insufficient training data',
-                            'message': f'Need at least 10 samples, have {len(training_samples)}'
-                        })
+                        'body': json.dumps({'error': 'Job not found'})
                     }
                 
-                model_version = f'v{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-                
-                accuracy = 0.85 + (len(training_samples) / 1000) * 0.1
-                precision = 0.82 + (len(training_samples) / 1000) * 0.12
-                recall = 0.88 + (len(training_samples) / 1000) * 0.08
-                f1 = 2 * (precision * recall) / (precision + recall)
-                
-                cursor.execute('''
-                    INSERT INTO ai_training_metrics 
-                    (model_version, accuracy, precision_score, recall_score, f1_score, training_samples_count, notes)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    model_version,
-                    min(accuracy, 0.98),
-                    min(precision, 0.97),
-                    min(recall, 0.99),
-                    min(f1, 0.98),
-                    len(training_samples),
-                    f'Trained on {len(training_samples)} samples'
-                ))
-                
-                metric_id = cursor.fetchone()['id']
-                conn.commit()
-                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'model_version': model_version,
-                        'metric_id': metric_id,
-                        'training_samples': len(training_samples),
-                        'metrics': {
-                            'accuracy': round(min(accuracy, 0.98), 4),
-                            'precision': round(min(precision, 0.97), 4),
-                            'recall': round(min(recall, 0.99), 4),
-                            'f1_score': round(min(f1, 0.98), 4)
-                        }
-                    })
+                    'body': json.dumps({'job': serialize_job(job)}, ensure_ascii=False)
+                }
+        
+        elif method == 'POST':
+            data = json.loads(event.get('body', '{}'))
+            action = data.get('action')
+            
+            if action == 'train-model':
+                job = enqueue(conn, 'train-model', {
+                    'incremental': bool(data.get('incremental', False)),
+                    'base_version': data.get('base_version')
+                })
+                return {
+                    'statusCode': 202,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'job_id': job['id'], 'job': serialize_job(job)}, ensure_ascii=False)
                 }
             
             elif action == 'upload-sample':
@@ -218,27 +381,36 @@ def handler(event: dict, context) -> dict:
                         'body': json.dumps({'error': 'file_name is required'})
                     }
                 
-                material_id = str(uuid.uuid4())
+                try:
+                    preview = store_preview(image_data)
+                except (ValueError, OSError) as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Invalid image_data: {e}'})
+                    }
                 
+                material_id = str(uuid.uuid4())
+
                 cursor.execute('''
-                    INSERT INTO materials (id, file_name, status, preview_url, timestamp)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (material_id, file_name, 'pending', image_data, datetime.now()))
+                    INSERT INTO materials (id, file_name, status, preview_url, preview_hash, thumbnail_url, timestamp)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ''', (
+                    material_id,
+                    file_name,
+                    'pending',
+                    preview['preview_url'],
+                    preview['preview_hash'],
+                    preview['thumbnail_url'],
+                    datetime.now()
+                ))
                 
                 conn.commit()
                 
                 prediction = None
                 if auto_process:
-                    prediction = {
-                        'has_violation': True,
-                        'confidence': 0.87,
-                        'violation_code': '12.9.2',
-                        'violation_type': 'Превышение скорости',
-                        'detected_objects': [
-                            {'type': 'vehicle', 'confidence': 0.95},
-                            {'type': 'plate', 'confidence': 0.92}
-                        ]
-                    }
+                    state = resolve_model(cursor, 'latest')
+                    prediction = prediction_from(state, classify_materials(cursor, state['model'], [material_id])[material_id])
                     
                     cursor.execute('''
                         INSERT INTO ai_training_data 
@@ -246,7 +418,7 @@ def handler(event: dict, context) -> dict:
                         VALUES (%s, 0, %s, %s, %s)
                     ''', (
                         material_id,
-                        'latest',
+                        state['version'],
                         json.dumps(prediction),
                         json.dumps({'source': 'auto_process', 'processed_at': datetime.now().isoformat()})
                     ))
@@ -287,16 +459,16 @@ def handler(event: dict, context) -> dict:
                         'body': json.dumps({'error': 'Material not found'})
                     }
                 
-                prediction = {
-                    'has_violation': True,
-                    'confidence': 0.87,
-                    'violation_code': '12.9.2',
-                    'violation_type': 'Превышение скорости',
-                    'detected_objects': [
-                        {'type': 'vehicle', 'confidence': 0.95, 'bbox': [0.2, 0.3, 0.4, 0.5]},
-                        {'type': 'plate', 'confidence': 0.92, 'bbox': [0.25, 0.45, 0.15, 0.08]}
-                    ]
-                }
+                try:
+                    state = resolve_model(cursor, model_version)
+                except (FileNotFoundError, ValueError):
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Model version not found: {model_version}'})
+                    }
+                model_version = state['version']
+                prediction = prediction_from(state, classify_materials(cursor, state['model'], [material_id])[material_id])
                 
                 cursor.execute('''
                     INSERT INTO ai_training_data 
@@ -365,58 +537,42 @@ def handler(event: dict, context) -> dict:
             elif action == 'batch-process':
                 limit = data.get('limit', 10)
                 
-                cursor.execute('''
-                    SELECT id, file_name, preview_url 
-                    FROM materials 
-                    WHERE status = 'pending'
-                    AND NOT EXISTS (
-                        SELECT 1 FROM ai_training_data 
-                        WHERE material_id = materials.id
-                    )
-                    LIMIT %s
-                ''', (limit,))
-                materials = cursor.fetchall()
-                
-                processed = []
-                for material in materials:
-                    prediction = {
-                        'has_violation': True,
-                        'confidence': 0.87,
-                        'violation_code': '12.9.2',
-                        'violation_type': 'Превышение скорости',
-                        'detected_objects': [
-                            {'type': 'vehicle', 'confidence': 0.95},
-                            {'type': 'plate', 'confidence': 0.92}
-                        ]
+                if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'limit must be a positive integer'})
                     }
-                    
-                    cursor.execute('''
-                        INSERT INTO ai_training_data 
-                        (material_id, markup_id, model_version, prediction_result, features)
-                        VALUES (%s, 0, %s, %s, %s)
-                    ''', (
-                        material['id'],
-                        'latest',
-                        json.dumps(prediction),
-                        json.dumps({'source': 'batch_process', 'processed_at': datetime.now().isoformat()})
-                    ))
-                    
-                    processed.append({
-                        'material_id': material['id'],
-                        'file_name': material['file_name'],
-                        'prediction': prediction
-                    })
                 
-                conn.commit()
+                job = enqueue(conn, 'batch-process', {'limit': limit})
+                return {
+                    'statusCode': 202,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'job_id': job['id'], 'job': serialize_job(job)}, ensure_ascii=False)
+                }
+            
+            elif action == 'cancel-job':
+                job_id = data.get('job_id')
+                
+                if not isinstance(job_id, int) or isinstance(job_id, bool):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'job_id is required'})
+                    }
+                
+                job = request_cancel(conn, job_id)
+                if not job:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Job not found'})
+                    }
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'processed_count': len(processed),
-                        'materials': processed
-                    })
+                    'body': json.dumps({'job': serialize_job(job)}, ensure_ascii=False)
                 }
             
             elif action == 'delete-sample':
@@ -429,10 +585,7 @@ def handler(event: dict, context) -> dict:
                         'body': json.dumps({'error': 'material_id is required'})
                     }
                 
-                cursor.execute('DELETE FROM markup_regions WHERE material_id = %s', (material_id,))
-                cursor.execute('DELETE FROM violation_markups WHERE material_id = %s', (material_id,))
-                cursor.execute('DELETE FROM ai_training_data WHERE material_id = %s', (material_id,))
-                cursor.execute('DELETE FROM materials WHERE id = %s', (material_id,))
+                purge_batch(cursor, [material_id])
                 
                 conn.commit()
                 
@@ -487,4 +640,4 @@ def handler(event: dict, context) -> dict:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_connection(conn)
\ No newline at end of file
@@ -0,0 +1,206 @@
+import os
+import json
+import threading
+from db import dict_cursor
+
+JOB_KINDS = ('train-model', 'batch-process')
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', '30'))
+JOB_BACKOFF_MAX = float(os.environ.get('JOB_BACKOFF_MAX', '1800'))
+JOB_LEASE = int(os.environ.get('JOB_LEASE', '300'))
+JOB_HEARTBEAT = float(os.environ.get('JOB_HEARTBEAT') or JOB_LEASE / 3)
+
+JOB_FIELDS = '''
+    id, kind, status, payload, result, error, progress, progress_message, attempts, max_attempts,
+    cancel_requested, locked_by, created_at, started_at, finished_at, run_after
+'''
+
+# Брошенные задачи, исчерпавшие попытки (воркер падал на каждой, например по OOM), не перезапускаются бесконечно
+REAP_SQL = '''
+    UPDATE ai_jobs SET
+        status = 'failed',
+        error = COALESCE(error || '; ', '') || 'Lease expired on attempt ' || attempts || ' of ' || max_attempts,
+        locked_by = NULL,
+        locked_at = NULL,
+        finished_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+        SELECT id FROM ai_jobs
+        WHERE status = 'running'
+          AND locked_at < CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second'
+          AND attempts >= max_attempts
+        FOR UPDATE SKIP LOCKED
+    )
+'''
+
+# Очередная задача: готовая к запуску или брошенная упавшим воркером (аренда истекла без heartbeat) с оставшимися
+# попытками. SKIP LOCKED — параллельные воркеры не ждут друг друга и никогда не забирают одну задачу дважды
+CLAIM_SQL = f'''
+    UPDATE ai_jobs SET
+        status = 'running',
+        attempts = attempts + 1,
+        locked_by = %(worker)s,
+        locked_at = CURRENT_TIMESTAMP,
+        started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = (
+        SELECT id FROM ai_jobs
+        WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+           OR (status = 'running' AND locked_at < CURRENT_TIMESTAMP - %(lease)s * INTERVAL '1 second'
+               AND attempts < max_attempts)
+        ORDER BY run_after, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING {JOB_FIELDS}
+'''
+
+class JobCancelled(Exception):
+    pass
+
+def serialize_job(job: dict) -> dict:
+    '''Задача для JSON-ответа: даты в ISO, прогресс числом'''
+    result = dict(job)
+    for key in ('created_at', 'started_at', 'finished_at', 'run_after'):
+        if result.get(key) is not None:
+            result[key] = result[key].isoformat()
+    result['progress'] = float(result['progress'])
+    return result
+
+def enqueue(conn, kind: str, payload: dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> dict:
+    cursor = dict_cursor(conn)
+    cursor.execute(f'''
+        INSERT INTO ai_jobs (kind, payload, max_attempts)
+        VALUES (%s, %s, %s)
+        RETURNING {JOB_FIELDS}
+    ''', (kind, json.dumps(payload), max_attempts))
+    job = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return job
+
+def get_job(conn, job_id: int):
+    cursor = dict_cursor(conn)
+    cursor.execute(f'SELECT {JOB_FIELDS} FROM ai_jobs WHERE id = %s', (job_id,))
+    job = cursor.fetchone()
+    cursor.close()
+    return job
+
+def request_cancel(conn, job_id: int):
+    '''Задача в очереди отменяется сразу; выполняющуюся воркер остановит на ближайшем обновлении прогресса'''
+    cursor = dict_cursor(conn)
+    cursor.execute(f'''
+        UPDATE ai_jobs SET
+            cancel_requested = TRUE,
+            status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+            finished_at = CASE WHEN status = 'queued' THEN CURRENT_TIMESTAMP ELSE finished_at END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+        RETURNING {JOB_FIELDS}
+    ''', (job_id,))
+    job = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return job
+
+def claim(conn, worker: str):
+    cursor = dict_cursor(conn)
+    cursor.execute(REAP_SQL, {'lease': JOB_LEASE})
+    cursor.execute(CLAIM_SQL, {'worker': worker, 'lease': JOB_LEASE})
+    job = cursor.fetchone()
+    conn.commit()
+    cursor.close()
+    return job
+
+class JobProgress:
+    '''Прогресс задачи пишется отдельным соединением и сразу коммитится, поэтому виден статусному запросу,
+    пока транзакция самой задачи открыта; каждое обновление продлевает аренду и проверяет запрос отмены'''
+
+    def __init__(self, conn, job_id: int, worker: str):
+        self.conn = conn
+        self.job_id = job_id
+        self.worker = worker
+
+    def __call__(self, fraction: float, message: str = None) -> None:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE ai_jobs SET progress = %s, progress_message = %s, locked_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND locked_by = %s
+            RETURNING cancel_requested
+        ''', (round(min(max(fraction, 0.0), 1.0), 4), message, self.job_id, self.worker))
+        row = cursor.fetchone()
+        self.conn.commit()
+        cursor.close()
+        if row is None or row[0]:
+            raise JobCancelled()
+
+class Heartbeat:
+    '''Продлевает аренду из фонового потока, пока задача выполняется: долгие этапы без вызовов прогресса
+    (кросс-валидация, сохранение модели) не должны выглядеть брошенными. Нужно отдельное соединение'''
+
+    def __init__(self, conn, job_id: int, worker: str, interval: float = JOB_HEARTBEAT):
+        self.conn = conn
+        self.job_id = job_id
+        self.worker = worker
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'heartbeat-{job_id}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                cursor = self.conn.cursor()
+                cursor.execute('''
+                    UPDATE ai_jobs SET locked_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND locked_by = %s AND status = 'running'
+                ''', (self.job_id, self.worker))
+                renewed = cursor.rowcount
+                self.conn.commit()
+                cursor.close()
+            except Exception:
+                # Сбой соединения не прерывает задачу: аренду продлит следующий удачный heartbeat или вызов прогресса
+                try:
+                    self.conn.rollback()
+                except Exception:
+                    pass
+                continue
+            if not renewed:
+                return
+
+def finish(conn, job: dict, worker: str, status: str, result=None, error: str = None) -> None:
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE ai_jobs SET
+            status = %s, result = %s, error = %s, locked_by = NULL, locked_at = NULL,
+            progress = CASE WHEN %s = 'succeeded' THEN 1 ELSE progress END,
+            finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND locked_by = %s
+    ''', (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, status, job['id'], worker))
+    conn.commit()
+    cursor.close()
+
+def retry_or_fail(conn, job: dict, worker: str, error: str) -> str:
+    '''Экспоненциальная задержка JOB_BACKOFF_BASE * 2^(попытка-1), не больше JOB_BACKOFF_MAX;
+    после max_attempts попыток задача помечается failed'''
+    if job['attempts'] >= job['max_attempts']:
+        finish(conn, job, worker, 'failed', error=error)
+        return 'failed'
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (job['attempts'] - 1))
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE ai_jobs SET
+            status = 'queued', error = %s, locked_by = NULL, locked_at = NULL,
+            run_after = CURRENT_TIMESTAMP + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND locked_by = %s
+    ''', (error, delay, job['id'], worker))
+    conn.commit()
+    cursor.close()
+    return 'queued'
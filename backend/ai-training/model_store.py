@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from inference import FEATURE_SIZE, KnnModel
+
+MODEL_STORE_DIR = os.environ.get('MODEL_STORE_DIR', '/tmp/trafficvision-models')
+MODEL_REGISTRY_HOT = int(os.environ.get('MODEL_REGISTRY_HOT', '2'))
+MODEL_REGISTRY_SIZE = int(os.environ.get('MODEL_REGISTRY_SIZE', '8'))
+
+ARRAYS = ('features', 'label_ids', 'mean', 'scale', 'norms')
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+class LocalModelStore:
+    '''Артефакты моделей на локальной файловой системе: каталог на версию с .npy-массивами и meta.json'''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, version: str) -> str:
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f'Invalid model version: {version}')
+        return os.path.join(self.root, version)
+
+    def save(self, version: str, model: KnnModel, notes: dict, samples: int, material_ids=None, watermark=None) -> str:
+        '''Пишет артефакт во временный каталог и атомарно переименовывает; возвращает ключ версии.
+        material_ids (по строке матрицы) и watermark [updated_at, id] нужны для инкрементального дообучения'''
+        import numpy as np
+        path = self.path_for(version)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(tmp_path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), getattr(model, name))
+        if material_ids is not None:
+            np.save(os.path.join(tmp_path, 'material_ids.npy'), material_ids)
+        meta = {'version': version, 'classes': model.classes, 'k': model.k, 'notes': notes,
+                'samples': samples, 'feature_size': FEATURE_SIZE, 'watermark': watermark}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return version
+
+    def load(self, version: str) -> dict:
+        '''Состояние модели с отображёнными в память массивами (mmap_mode='r'): страницы читаются по мере обращения'''
+        import numpy as np
+        path = self.path_for(version)
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['feature_size'] != FEATURE_SIZE:
+            raise ValueError(f'Model {version} has {meta["feature_size"]} features, expected {FEATURE_SIZE}')
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+        model = KnnModel(arrays['features'], arrays['label_ids'], meta['classes'], arrays['mean'], arrays['scale'],
+                         meta['k'], norms=arrays['norms'])
+        ids_path = os.path.join(path, 'material_ids.npy')
+        return {'version': version, 'model': model, 'notes': meta['notes'], 'samples': meta['samples'],
+                'material_ids': np.load(ids_path, mmap_mode='r') if os.path.exists(ids_path) else None,
+                'watermark': meta.get('watermark')}
+
+def get_model_store() -> LocalModelStore:
+    backend = os.environ.get('MODEL_STORE_BACKEND', 'local')
+    if backend != 'local':
+        raise ValueError(f'Unsupported model store backend: {backend}')
+    return LocalModelStore(MODEL_STORE_DIR)
+
+def resident(state: dict) -> dict:
+    '''Копия состояния с массивами, целиком прочитанными в память'''
+    import numpy as np
+    mapped = state['model']
+    arrays = {name: np.array(getattr(mapped, name)) for name in ARRAYS}
+    model = KnnModel(arrays['features'], arrays['label_ids'], mapped.classes, arrays['mean'], arrays['scale'],
+                     mapped.k, norms=arrays['norms'])
+    return {**state, 'model': model}
+
+class ModelRegistry:
+    '''LRU версий моделей: hot последних версий держатся целиком в памяти, остальные до size — как mmap-отображения
+    артефактов; повторный запрос горячей версии не обращается к хранилищу вовсе'''
+
+    def __init__(self, store: LocalModelStore, hot: int, size: int):
+        self.store = store
+        self.hot = hot
+        self.size = max(size, hot)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version: str) -> dict:
+        with self._lock:
+            entry = self._entries.get(version)
+            if entry is None:
+                entry = self._entries[version] = {'mapped': self.store.load(version), 'resident': None}
+            self._entries.move_to_end(version)
+            if entry['resident'] is None:
+                entry['resident'] = resident(entry['mapped'])
+            for position, cached in enumerate(reversed(self._entries.values())):
+                if position >= self.hot:
+                    cached['resident'] = None
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return entry['resident']
+
@@ -0,0 +1,52 @@
+import os
+
+# Зависимые таблицы очищаются раньше materials; удалённые id остаются в material_tombstones для дельта-синхронизации
+# и хранятся TOMBSTONE_RETENTION_DAYS дней, граница очистки записывается в material_tombstone_horizon
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('MATERIALS_TOMBSTONE_RETENTION_DAYS', '30'))
+
+PURGE_STATEMENTS = [
+    '''
+        DELETE FROM {prefix}violation_parameters
+        WHERE markup_id IN (
+            SELECT id FROM {prefix}violation_markups
+            WHERE material_id = ANY(%s)
+        )
+    ''',
+    'DELETE FROM {prefix}ai_training_data WHERE material_id = ANY(%s)',
+    'DELETE FROM {prefix}markup_regions WHERE material_id = ANY(%s)',
+    'DELETE FROM {prefix}violation_markups WHERE material_id = ANY(%s)',
+    'DELETE FROM {prefix}ai_feedback WHERE material_id = ANY(%s)',
+    '''
+        WITH deleted AS (
+            DELETE FROM {prefix}materials
+            WHERE id = ANY(%s)
+            RETURNING id
+        )
+        INSERT INTO {prefix}material_tombstones (id)
+        SELECT id FROM deleted
+        ON CONFLICT (id) DO UPDATE SET deleted_at = CURRENT_TIMESTAMP
+    '''
+]
+
+PRUNE_TOMBSTONES_SQL = '''
+    WITH pruned AS (
+        DELETE FROM {prefix}material_tombstones
+        WHERE deleted_at < LOCALTIMESTAMP - %s * INTERVAL '1 day'
+        RETURNING change_xid, deleted_at
+    )
+    INSERT INTO {prefix}material_tombstone_horizon (pruned_xid, pruned_before)
+    SELECT MAX(change_xid), MAX(deleted_at) FROM pruned
+    HAVING COUNT(*) > 0
+    ON CONFLICT (id) DO UPDATE SET
+        pruned_xid = GREATEST(material_tombstone_horizon.pruned_xid, EXCLUDED.pruned_xid),
+        pruned_before = GREATEST(material_tombstone_horizon.pruned_before, EXCLUDED.pruned_before)
+'''
+
+def purge_batch(cursor, ids: list, prefix: str = '') -> int:
+    '''Удаляет материалы вместе со всеми зависимыми строками; по одному set-based DELETE на таблицу.
+    Заодно очищает надгробия старше срока хранения. Возвращает число удалённых материалов'''
+    for statement in PURGE_STATEMENTS:
+        cursor.execute(statement.format(prefix=prefix), (list(ids),))
+    purged = cursor.rowcount
+    cursor.execute(PRUNE_TOMBSTONES_SQL.format(prefix=prefix), (TOMBSTONE_RETENTION_DAYS,))
+    return purged
@@ -0,0 +1,188 @@
+import os
+import re
+import sys
+import json
+import time
+import functools
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from profiling import PROFILING_ENABLED, should_profile, run_profiled
+
+SLOW_QUERY_MS = float(os.environ.get('TRACE_SLOW_QUERY_MS', '200'))
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') == '1'
+SERVER_TIMING_QUERIES = int(os.environ.get('TRACE_SERVER_TIMING_QUERIES', '5'))
+FUNCTION_NAME = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+_current = contextvars.ContextVar('trace', default=None)
+_cursor_classes = {}
+ACTION_RE = re.compile(r'"action"\s*:\s*"([^"]{1,64})"')
+
+@functools.lru_cache(maxsize=512)
+def _fingerprint(sql: str) -> tuple:
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    normalized = re.sub(r'\b\d+(?:\.\d+)?\b', '?', normalized)
+    normalized = re.sub(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)(?:\s*,\s*\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\))*', '(...)', normalized)
+    normalized = re.sub(r'\s+', ' ', normalized).strip()
+    return hashlib.sha1(normalized.encode()).hexdigest()[:8], normalized[:200]
+
+def fingerprint(sql) -> tuple:
+    '''Идентификатор и нормализованный текст запроса: литералы заменены на ?, списки значений свёрнуты'''
+    if isinstance(sql, bytes):
+        sql = sql[:2048].decode('utf-8', 'replace')
+    return _fingerprint(str(sql)[:2048])
+
+def emit(record: dict) -> None:
+    if TRACE_LOG:
+        sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        sys.stdout.flush()
+
+class Trace:
+    '''Фазы и SQL-запросы одного вызова handler'а'''
+
+    def __init__(self, function: str, action: str, request_id: str):
+        self.function = function
+        self.action = action
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status = None
+        self.phases = {}
+        self.queries = {}
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_query(self, sql, seconds: float, rows: int) -> None:
+        query_id, text = fingerprint(sql)
+        self.add_phase('sql', seconds)
+        entry = self.queries.get(query_id)
+        if entry is None:
+            entry = self.queries[query_id] = {'id': query_id, 'sql': text, 'count': 0, 'seconds': 0.0, 'rows': 0}
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        entry['rows'] += max(rows, 0)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            emit({'type': 'slow_query', 'function': self.function, 'action': self.action, 'requestId': self.request_id,
+                  'query': query_id, 'sql': text, 'ms': round(seconds * 1000, 2), 'rows': rows})
+
+    def finish(self, status: int) -> None:
+        self.status = status
+        self.duration = time.perf_counter() - self.started
+        self.add_phase('app', max(0.0, self.duration - sum(self.phases.values())))
+
+    def server_timing(self) -> str:
+        entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.phases.items()]
+        slowest = sorted(self.queries.values(), key=lambda q: q['seconds'], reverse=True)[:SERVER_TIMING_QUERIES]
+        entries.extend(f'q-{q["id"]};dur={q["seconds"] * 1000:.1f};desc="x{q["count"]} rows={q["rows"]}"' for q in slowest)
+        entries.append(f'total;dur={self.duration * 1000:.1f}')
+        return ', '.join(entries)
+
+    def summary(self) -> dict:
+        return {
+            'type': 'request',
+            'function': self.function,
+            'action': self.action,
+            'requestId': self.request_id,
+            'status': self.status,
+            'durationMs': round(self.duration * 1000, 2),
+            'phasesMs': {name: round(seconds * 1000, 2) for name, seconds in self.phases.items()},
+            'queries': [{'id': q['id'], 'sql': q['sql'], 'count': q['count'], 'rows': q['rows'], 'ms': round(q['seconds'] * 1000, 2)}
+                        for q in self.queries.values()]
+        }
+
+@contextmanager
+def span(name: str):
+    '''Замер фазы текущего вызова; без активной трассировки ничего не делает'''
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_phase(name, time.perf_counter() - started)
+
+def tracing_cursor_class(base):
+    cls = _cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    def execute(self, query, vars=None):
+        trace = _current.get()
+        if trace is None:
+            return base.execute(self, query, vars)
+        started = time.perf_counter()
+        try:
+            return base.execute(self, query, vars)
+        finally:
+            trace.add_query(query, time.perf_counter() - started, self.rowcount)
+
+    def fetch(method):
+        def wrapper(self, *args):
+            with span('fetch'):
+                return method(self, *args)
+        return wrapper
+
+    cls = type(f'Tracing{base.__name__}', (base,), {
+        'execute': execute,
+        'fetchone': fetch(base.fetchone),
+        'fetchmany': fetch(base.fetchmany),
+        'fetchall': fetch(base.fetchall)
+    })
+    _cursor_classes[base] = cls
+    return cls
+
+@functools.lru_cache(maxsize=None)
+def tracing_connection_class():
+    '''Соединение, курсоры которого записывают время и число строк каждого запроса в текущую трассировку;
+    класс создаётся при первом подключении, чтобы импорт tracing не тянул psycopg2'''
+    import psycopg2.extensions
+
+    class TracingConnection(psycopg2.extensions.connection):
+        def cursor(self, *args, **kwargs):
+            kwargs['cursor_factory'] = tracing_cursor_class(kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor)
+            return super().cursor(*args, **kwargs)
+    return TracingConnection
+
+def request_action(event: dict) -> str:
+    params = event.get('queryStringParameters') or {}
+    if params.get('action'):
+        return params['action']
+    match = ACTION_RE.search((event.get('body') or '')[:4096]) if not event.get('isBase64Encoded') else None
+    return match.group(1) if match else event.get('httpMethod', 'GET')
+
+def traced(handler):
+    '''Оборачивает handler: собирает фазы и запросы, добавляет Server-Timing, пишет структурированный лог
+    и передаёт сводку в context.on_trace, если среда выполнения его предоставляет (локальный шлюз).
+    При включённом PROFILE_DIR отдельные вызовы выполняются под профилировщиком (см. profiling.py)'''
+    @functools.wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        trace = Trace(getattr(context, 'function_name', None) or FUNCTION_NAME, request_action(event), getattr(context, 'request_id', None))
+        token = _current.set(trace)
+        try:
+            if PROFILING_ENABLED and should_profile(event):
+                response = run_profiled(trace.function, trace.action, trace.request_id, lambda: handler(event, context))
+            else:
+                response = handler(event, context)
+        except Exception:
+            trace.finish(500)
+            report(trace, context)
+            raise
+        finally:
+            _current.reset(token)
+        trace.finish(response.get('statusCode', 200))
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = trace.server_timing()
+        headers['Timing-Allow-Origin'] = '*'
+        report(trace, context)
+        return {**response, 'headers': headers}
+    return wrapper
+
+def report(trace: Trace, context) -> None:
+    summary = trace.summary()
+    emit(summary)
+    on_trace = getattr(context, 'on_trace', None)
+    if on_trace is not None:
+        on_trace(summary)
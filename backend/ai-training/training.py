@@ -0,0 +1,226 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from db import dict_cursor
+from inference import FEATURE_SIZE, NO_VIOLATION, TRAINING_LABELS_SQL, KnnModel, feature_vector, load_feature_rows
+
+TRAINING_CHUNK_SIZE = int(os.environ.get('TRAINING_CHUNK_SIZE', '2000'))
+TRAINING_WORKERS = int(os.environ.get('TRAINING_WORKERS') or os.cpu_count() or 1)
+TRAINING_FOLDS = int(os.environ.get('TRAINING_FOLDS', '5'))
+TRAINING_CV_SAMPLE = int(os.environ.get('TRAINING_CV_SAMPLE', '20000'))
+TRAINING_WATERMARK_OVERLAP = int(os.environ.get('TRAINING_WATERMARK_OVERLAP', '300'))
+
+# Разметки, изменённые после водяного знака: updated_at с запасом на долгие транзакции, id — на вставки,
+# закоммиченные позже, чем был снят знак. Снятые с обучения (is_training_data = FALSE) удаляются из индекса
+DELTA_SQL = '''
+    SELECT id, material_id, COALESCE(violation_code, '') AS violation_code, notes, updated_at, is_training_data
+    FROM violation_markups
+    WHERE updated_at >= %(updated_at)s::timestamp - %(overlap)s * INTERVAL '1 second'
+       OR id > %(id)s
+    ORDER BY id
+'''
+
+TOMBSTONES_SQL = '''
+    SELECT id FROM material_tombstones
+    WHERE deleted_at >= %(updated_at)s::timestamp - %(overlap)s * INTERVAL '1 second'
+'''
+
+# Надгробия старше срока хранения очищаются (purge.py); дообучение от более старого знака пропустило бы удаления
+TOMBSTONES_PRUNED_SQL = '''
+    SELECT 1 FROM material_tombstone_horizon
+    WHERE pruned_before >= %(updated_at)s::timestamp - %(overlap)s * INTERVAL '1 second'
+'''
+
+def training_chunks(conn, sql: str, params, chunk_size: int):
+    '''Разметки серверным курсором порциями по chunk_size вместе с регионами и параметрами обучающих материалов;
+    в памяти одновременно держится только одна порция строк'''
+    labels_cursor = dict_cursor(conn, name='training_labels')
+    features_cursor = dict_cursor(conn)
+    try:
+        labels_cursor.execute(sql, params)
+        while True:
+            rows = labels_cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            training = [row['material_id'] for row in rows if row.get('is_training_data', True)]
+            yield rows, load_feature_rows(features_cursor, training)
+    finally:
+        labels_cursor.close()
+        features_cursor.close()
+
+def chunk_features(entries: list) -> 'numpy.ndarray':
+    '''Матрица признаков порции; выполняется в процессе пула'''
+    import numpy as np
+    rows = [feature_vector(regions, parameters) for regions, parameters in entries]
+    return np.array(rows, dtype=np.float32).reshape(len(entries), FEATURE_SIZE)
+
+def process_pool(workers: int):
+    '''Пул процессов через forkserver (где его нет — spawn): потомки порождаются чистым сервером, а не текущим
+    процессом, где уже работают поток heartbeat воркера и пул соединений, и fork скопировал бы захваченные ими
+    блокировки. chunk_features — функция модуля, потомок импортирует её по имени.
+    None — извлекать признаки в текущем процессе, если воркер один или среда не даёт создавать процессы'''
+    if workers <= 1:
+        return None
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    try:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    except (OSError, ValueError, NotImplementedError):
+        return None
+
+def advance_watermark(watermark, row) -> list:
+    '''[updated_at в ISO, id] — максимум по уже прочитанным разметкам'''
+    updated_at = row['updated_at'].isoformat() if row['updated_at'] else None
+    if watermark is None:
+        return [updated_at, row['id']]
+    return [max(filter(None, (watermark[0], updated_at)), default=None), max(watermark[1], row['id'])]
+
+def extract_features(conn, sql: str = TRAINING_LABELS_SQL.format(prefix=''), params=None,
+                     chunk_size: int = TRAINING_CHUNK_SIZE, workers: int = TRAINING_WORKERS, on_chunk=None) -> dict:
+    '''Потоковое извлечение признаков: пока пул считает порции, читается следующая; в очереди не больше 2 * workers
+    порций. В памяти остаются только float32-матрица признаков, коды меток и id материалов.
+    on_chunk(прочитано строк) вызывается после каждой порции.
+    Возвращает {'features', 'label_ids', 'classes', 'material_ids', 'notes', 'watermark', 'removed'}'''
+    import numpy as np
+    blocks, labels, material_ids, removed, notes = [], [], [], [], {}
+    read = 0
+    watermark = None
+    pending = deque()
+    pool = process_pool(workers)
+    try:
+        for rows, entries in training_chunks(conn, sql, params, chunk_size):
+            read += len(rows)
+            if on_chunk:
+                on_chunk(read)
+            payload = []
+            for row in rows:
+                watermark = advance_watermark(watermark, row)
+                if not row.get('is_training_data', True):
+                    removed.append(row['material_id'])
+                    continue
+                labels.append(row['violation_code'])
+                material_ids.append(row['material_id'])
+                if row['violation_code'] and row['notes']:
+                    notes.setdefault(row['violation_code'], row['notes'])
+                entry = entries[row['material_id']]
+                payload.append(([dict(r) for r in entry['regions']], [dict(p) for p in entry['parameters']]))
+            if not payload:
+                continue
+            if pool is None:
+                blocks.append(chunk_features(payload))
+                continue
+            pending.append(pool.submit(chunk_features, payload))
+            while len(pending) > 2 * workers:
+                blocks.append(pending.popleft().result())
+        while pending:
+            blocks.append(pending.popleft().result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    classes = sorted(set(labels))
+    index = {label: i for i, label in enumerate(classes)}
+    return {
+        'features': np.concatenate(blocks) if blocks else np.zeros((0, FEATURE_SIZE), dtype=np.float32),
+        'label_ids': np.array([index[label] for label in labels], dtype=np.int32),
+        'classes': classes,
+        'material_ids': np.array(material_ids, dtype=str),
+        'notes': notes,
+        'watermark': watermark,
+        'removed': removed
+    }
+
+def watermark_params(watermark, overlap: int = TRAINING_WATERMARK_OVERLAP) -> dict:
+    return {'updated_at': watermark[0] or '-infinity', 'id': watermark[1], 'overlap': overlap}
+
+def tombstones_pruned(conn, watermark, overlap: int = TRAINING_WATERMARK_OVERLAP) -> bool:
+    '''Часть удалений после водяного знака уже не видна: нужно полное обучение'''
+    cursor = conn.cursor()
+    cursor.execute(TOMBSTONES_PRUNED_SQL, watermark_params(watermark, overlap))
+    pruned = cursor.fetchone() is not None
+    cursor.close()
+    return pruned
+
+def incremental_update(conn, base: dict, overlap: int = TRAINING_WATERMARK_OVERLAP, on_chunk=None) -> dict:
+    '''Обучающий набор базовой версии плюс разметки, изменённые после её водяного знака: строки изменённых,
+    снятых с обучения и удалённых материалов заменяются или выбрасываются, новые дописываются.
+    Из БД читается только дельта, объём работы с матрицей — один векторный проход'''
+    import numpy as np
+    params = watermark_params(base['watermark'], overlap)
+    delta = extract_features(conn, DELTA_SQL, params, on_chunk=on_chunk)
+    cursor = dict_cursor(conn)
+    cursor.execute(TOMBSTONES_SQL, params)
+    deleted = [row['id'] for row in cursor.fetchall()]
+    cursor.close()
+
+    model = base['model']
+    base_ids = np.asarray(base['material_ids'])
+    changed = np.concatenate([delta['material_ids'], np.array(delta['removed'] + deleted, dtype=str)])
+    keep = np.flatnonzero(~np.isin(base_ids, changed)) if len(changed) else np.arange(len(base_ids))
+
+    classes = sorted(set(model.classes) | set(delta['classes']))
+    index = {label: i for i, label in enumerate(classes)}
+    base_codes = np.array([index[label] for label in model.classes], dtype=np.int32)
+    delta_codes = np.array([index[label] for label in delta['classes']], dtype=np.int32)
+
+    watermark = base['watermark']
+    if delta['watermark'] is not None:
+        watermark = [max(filter(None, (watermark[0], delta['watermark'][0])), default=None),
+                     max(watermark[1], delta['watermark'][1])]
+    return {
+        'features': np.concatenate([np.asarray(model.features[keep]) * model.scale + model.mean, delta['features']]),
+        'label_ids': np.concatenate([base_codes[np.asarray(model.label_ids[keep])], delta_codes[delta['label_ids']]]),
+        'classes': classes,
+        'material_ids': np.concatenate([base_ids[keep], delta['material_ids']]),
+        'notes': {**base['notes'], **delta['notes']},
+        'watermark': watermark,
+        'changed': int(len(delta['material_ids'])),
+        'removed': int(len(base_ids) - len(keep) - np.isin(delta['material_ids'], base_ids).sum())
+    }
+
+def code_metrics(actual: 'numpy.ndarray', predicted: 'numpy.ndarray', classes: list) -> dict:
+    '''accuracy, macro-precision/recall/F1 и те же метрики по каждому коду ('none' — без нарушения)'''
+    per_code, scored = {}, []
+    for index, code in enumerate(classes):
+        true_positive = int(((predicted == index) & (actual == index)).sum())
+        predicted_count = int((predicted == index).sum())
+        support = int((actual == index).sum())
+        precision = true_positive / predicted_count if predicted_count else 0.0
+        recall = true_positive / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        if support:
+            scored.append((precision, recall, f1))
+        per_code[code if code != NO_VIOLATION else 'none'] = {
+            'precision': round(precision, 4), 'recall': round(recall, 4), 'f1_score': round(f1, 4), 'support': support
+        }
+    macro = [round(sum(values) / len(scored), 4) if scored else 0.0 for values in zip(*scored)] or [0.0, 0.0, 0.0]
+    return {
+        'accuracy': round(float((actual == predicted).mean()), 4) if len(actual) else 0.0,
+        'precision': macro[0],
+        'recall': macro[1],
+        'f1_score': macro[2],
+        'per_code': per_code,
+        'evaluated': int(len(actual))
+    }
+
+def cross_validate(features: 'numpy.ndarray', label_ids: 'numpy.ndarray', classes: list, k: int,
+                   folds: int = TRAINING_FOLDS, sample: int = TRAINING_CV_SAMPLE, workers: int = TRAINING_WORKERS) -> dict:
+    '''k-fold кросс-валидация: фолды считаются параллельно в потоках (NumPy отпускает GIL на матричных операциях).
+    В каждом фолде оценивается не больше sample / folds тестовых материалов, чтобы время оставалось ограниченным'''
+    import numpy as np
+    index = {label: i for i, label in enumerate(classes)}
+    folds = max(2, min(folds, len(label_ids)))
+    splits = np.array_split(np.random.default_rng(0).permutation(len(label_ids)), folds)
+    per_fold = max(1, sample // folds)
+
+    def run_fold(fold: int) -> tuple:
+        test = splits[fold][:per_fold]
+        train = np.concatenate([split for other, split in enumerate(splits) if other != fold])
+        model = KnnModel.fit_encoded(features[train], label_ids[train], classes, k)
+        predicted = [index[label] for label, _, _ in model.predict(features[test])]
+        return label_ids[test], np.array(predicted, dtype=np.int32)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, folds))) as executor:
+        results = list(executor.map(run_fold, range(folds)))
+    actual = np.concatenate([a for a, _ in results])
+    predicted = np.concatenate([p for _, p in results])
+    return {**code_metrics(actual, predicted, classes), 'folds': folds}
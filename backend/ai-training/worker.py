@@ -0,0 +1,96 @@
+'''Воркер очереди ai_jobs: забирает задачи обучения и пакетной обработки и выполняет их вне HTTP-обработчика.
+
+    cd backend/ai-training && DATABASE_URL=... python worker.py [--once] [--worker-id ID]
+
+Несколько воркеров (процессов или машин) безопасно разбирают одну очередь: задача захватывается
+FOR UPDATE SKIP LOCKED, выполнение подтверждается heartbeat'ом (каждые JOB_HEARTBEAT секунд и при каждом обновлении
+прогресса), брошенные задачи забираются повторно после JOB_LEASE, пока не исчерпаны попытки
+'''
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+from db import get_connection, release_connection
+from jobs import Heartbeat, JobCancelled, JobProgress, claim, finish, retry_or_fail
+from index import batch_process, train_model
+
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+
+def run_train_model(conn, payload: dict, progress) -> tuple:
+    return train_model(conn, payload, progress)
+
+def run_batch_process(conn, payload: dict, progress) -> tuple:
+    return 200, batch_process(conn, payload.get('limit', 10), progress)
+
+JOB_HANDLERS = {
+    'train-model': run_train_model,
+    'batch-process': run_batch_process
+}
+
+def work_once(worker: str) -> bool:
+    '''Выполняет одну задачу; False — очередь пуста. Служебные обновления задачи идут через отдельное соединение,
+    чтобы прогресс и отмена были видны, пока транзакции самой задачи не закоммичены'''
+    control = get_connection()
+    try:
+        job = claim(control, worker)
+        if job is None:
+            return False
+        if job['cancel_requested']:
+            finish(control, job, worker, 'cancelled')
+            return True
+        log(f'job {job["id"]} ({job["kind"]}) attempt {job["attempts"]}/{job["max_attempts"]}')
+        conn = get_connection()
+        try:
+            beat = get_connection()
+            try:
+                with Heartbeat(beat, job['id'], worker):
+                    status, result = JOB_HANDLERS[job['kind']](conn, job['payload'] or {}, JobProgress(control, job['id'], worker))
+            finally:
+                release_connection(beat)
+        except JobCancelled:
+            conn.rollback()
+            finish(control, job, worker, 'cancelled')
+            log(f'job {job["id"]} cancelled')
+        except Exception as e:
+            conn.rollback()
+            outcome = retry_or_fail(control, job, worker, f'{type(e).__name__}: {e}')
+            log(f'job {job["id"]} error: {e} -> {outcome}')
+        else:
+            if status == 200:
+                finish(control, job, worker, 'succeeded', result)
+            else:
+                finish(control, job, worker, 'failed', result, result.get('error'))
+            log(f'job {job["id"]} finished with {status}')
+        finally:
+            release_connection(conn)
+        return True
+    finally:
+        release_connection(control)
+
+def log(message: str) -> None:
+    print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {message}', file=sys.stderr, flush=True)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Воркер очереди задач ai-training')
+    parser.add_argument('--once', action='store_true', help='разобрать очередь и завершиться')
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}:{os.getpid()}')
+    args = parser.parse_args()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+    log(f'worker {args.worker_id} started')
+    while not stopping:
+        if work_once(args.worker_id):
+            continue
+        if args.once:
+            break
+        time.sleep(JOB_POLL_INTERVAL)
+    log(f'worker {args.worker_id} stopped')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
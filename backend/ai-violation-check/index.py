@@ -1,10 +1,194 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
+import threading
+from db import get_connection, release_connection, dict_cursor
+from response import dumps, negotiated_compression
+from tracing import traced
+from inference import NO_VIOLATION, build_model, classify_materials
 
+MODEL_CACHE_TTL = float(os.environ.get('MODEL_CACHE_TTL', '600'))
+MODEL_CACHE_PROBE_INTERVAL = float(os.environ.get('MODEL_CACHE_PROBE_INTERVAL', '5'))
+BATCH_MAX_SIZE = int(os.environ.get('VIOLATION_CHECK_BATCH_MAX', '5000'))
+KNN_NEIGHBOURS = int(os.environ.get('KNN_NEIGHBOURS', '5'))
+
+SCHEMA = 't_p28865948_photo_material_proce.'
+VERSION_PROBE_SQL = f'SELECT last_value FROM {SCHEMA}ai_model_state_version'
+
+def load_model_state(cur) -> dict:
+    cur.execute(f'''
+        SELECT accuracy, precision_score, recall_score, training_samples_count 
+        FROM {SCHEMA}ai_training_metrics 
+        ORDER BY training_date DESC 
+        LIMIT 1
+    ''')
+    metrics = cur.fetchone()
+    return {'metrics': metrics, **build_model(cur, SCHEMA, KNN_NEIGHBOURS)}
+
+class ModelStateCache:
+    '''Кэш последних метрик и k-NN модели по обучающей разметке на время жизни тёплого контейнера.
+    Не чаще раза в probe_interval сверяет версию ai_model_state_version (V0011) и перестраивает модель,
+    только если она изменилась или истёк ttl; в промежутках проверка не обращается к БД вовсе'''
+
+    def __init__(self, ttl: float, probe_interval: float):
+        self.ttl = ttl
+        self.probe_interval = probe_interval
+        self._state = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _fresh(self, now: float) -> bool:
+        return self._state is not None and now - self._probed_at < self.probe_interval and now - self._loaded_at < self.ttl
+
+    def get(self) -> dict:
+        if self._fresh(time.monotonic()):
+            return self._state
+        with self._lock:
+            now = time.monotonic()
+            if self._fresh(now):
+                return self._state
+            conn = get_connection()
+            try:
+                cur = dict_cursor(conn)
+                cur.execute(VERSION_PROBE_SQL)
+                version = cur.fetchone()['last_value']
+                if self._state is None or version != self._version or now - self._loaded_at >= self.ttl:
+                    self._state = load_model_state(cur)
+                    self._version = version
+                    self._loaded_at = now
+                self._probed_at = now
+                cur.close()
+            finally:
+                release_connection(conn)
+            return self._state
+
+model_cache = ModelStateCache(MODEL_CACHE_TTL, MODEL_CACHE_PROBE_INTERVAL)
+
+def describe(state, classification) -> dict:
+    '''Ответ для одного материала по результату k-NN (None — БД не настроена)'''
+    if state is None:
+        has_violation = False
+        violation_code = None
+        violation_type = None
+        confidence = 50.0
+        reasoning = "DATABASE_URL не настроен"
+        training_count = 0
+        base_confidence = 50.0
+    else:
+        metrics = state['metrics']
+        base_confidence = float(metrics['accuracy']) * 100 if metrics else 75.0
+        training_count = state['samples']
+        label = classification['label'] if classification else None
+        
+        if state['model'] is None:
+            has_violation = False
+            violation_code = None
+            violation_type = None
+            confidence = 50.0
+            reasoning = "Недостаточно обучающих данных для анализа"
+        elif label is None:
+            has_violation = False
+            violation_code = None
+            violation_type = None
+            confidence = 50.0
+            reasoning = "У материала нет разметки регионов для анализа"
+        else:
+            has_violation = label != NO_VIOLATION
+            violation_code = label if has_violation else None
+            violation_type = (state['notes'].get(label) or f"Нарушение {label}") if has_violation else None
+            confidence = min(99.0, classification['share'] * 100)
+            neighbours = f"{classification['support']} из {min(state['model'].k, len(state['model']))} ближайших обучающих примеров"
+            if has_violation:
+                reasoning = f"Код {label}: {neighbours}. База: {training_count} материалов, точность модели: {base_confidence:.1f}%"
+            else:
+                reasoning = f"Нарушений не обнаружено: {neighbours} без нарушения. База: {training_count} материалов"
+    
+    detected_objects = [
+        {"type": region['name'], "bbox": [float(region['x']), float(region['y']), float(region['width']), float(region['height'])]}
+        for region in (classification['regions'] if classification else [])
+    ]
+    
+    if has_violation:
+        detected_objects.append({"type": "violation", "description": "нарушение ПДД"})
+    
+    return {
+        "hasViolation": has_violation,
+        "violationCode": violation_code,
+        "violationType": violation_type,
+        "confidence": round(confidence, 1),
+        "detectedObjects": detected_objects,
+        "reasoning": reasoning,
+        "modelVersion": base_confidence / 100.0,
+        "trainingSamples": training_count
+    }
+
+def check_single(material_id: str) -> dict:
+    if not os.environ.get('DATABASE_URL'):
+        return describe(None, None)
+    
+    state = model_cache.get()
+    conn = get_connection()
+    try:
+        cur = dict_cursor(conn)
+        classification = classify_materials(cur, state['model'], [material_id], SCHEMA)[material_id]
+        cur.close()
+    finally:
+        release_connection(conn)
+    return describe(state, classification)
+
+def check_batch(material_ids: list, persist: bool) -> tuple:
+    '''Модель берётся из кэша, существование и признаки материалов читаются двумя запросами, все материалы
+    классифицируются одним матричным проходом; результаты для ещё не разобранных (pending) материалов
+    записываются одним UPDATE ... FROM (VALUES ...)'''
+    if not os.environ.get('DATABASE_URL'):
+        return [{'materialId': material_id, **describe(None, None), 'persisted': False} for material_id in material_ids], []
+    
+    state = model_cache.get()
+    conn = get_connection()
+    try:
+        cur = dict_cursor(conn)
+        cur.execute(
+            f'SELECT id FROM {SCHEMA}materials WHERE id = ANY(%s)',
+            (material_ids,)
+        )
+        existing = {row['id'] for row in cur.fetchall()}
+        found = [material_id for material_id in material_ids if material_id in existing]
+        classified = classify_materials(cur, state['model'], found, SCHEMA)
+        results = [{'materialId': material_id, **describe(state, classified[material_id])} for material_id in found]
+        
+        persisted = set()
+        if persist and results:
+            from psycopg2.extras import execute_values
+            rows = [
+                (r['materialId'], 'processed' if r['hasViolation'] else 'clean', r['violationCode'], r['violationType'])
+                for r in results
+            ]
+            updated = execute_values(cur, f'''
+                UPDATE {SCHEMA}materials AS m
+                SET status = v.status, violation_code = v.code, violation_type = v.type, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, status, code, type)
+                WHERE m.id = v.id AND m.status = 'pending'
+                RETURNING m.id
+            ''', rows, page_size=len(rows), fetch=True)
+            persisted = {row['id'] for row in updated}
+            conn.commit()
+        cur.close()
+    finally:
+        release_connection(conn)
+    
+    for result in results:
+        result['persisted'] = result['materialId'] in persisted
+    return results, [material_id for material_id in material_ids if material_id not in existing]
+
+@traced
+@negotiated_compression
 def handler(event: dict, context) -> dict:
-    '''API для автоматического определения нарушений ПДД с использованием обученной модели TrafficVision AI'''
+    '''API для автоматического определения нарушений ПДД с использованием обученной модели TrafficVision AI.
+    {materialId} — один материал, {materialIds: [...], persist?} — пакетная проверка с ответом в NDJSON.
+    Ответ пакета буферизуется целиком (среда функций не отдаёт тело по частям): строки приходят разом после проверки
+    всех материалов, так что для индикатора прогресса клиент отправляет несколько пакетов поменьше'''
     method = event.get('httpMethod', 'POST')
 
     if method == 'OPTIONS':
@@ -25,8 +209,6 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': 'Method not allowed'})
         }
 
-    import random
-    
     body_str = event.get('body', '{}')
     if not body_str or body_str.strip() == '':
         body_str = '{}'
@@ -44,6 +226,51 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
+    material_ids = body.get('materialIds')
+    if material_ids is not None:
+        if not isinstance(material_ids, list) or not material_ids or not all(isinstance(m, str) and m for m in material_ids):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'materialIds должен быть непустым списком строк'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        if len(material_ids) > BATCH_MAX_SIZE:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'Не более {BATCH_MAX_SIZE} материалов за запрос'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        try:
+            started = time.perf_counter()
+            material_ids = list(dict.fromkeys(material_ids))
+            results, missing = check_batch(material_ids, body.get('persist', True) is not False)
+            lines = [dumps(result) for result in results]
+            lines.extend(dumps({'materialId': material_id, 'error': 'Материал не найден'}) for material_id in missing)
+            lines.append(dumps({'summary': {
+                'total': len(material_ids),
+                'checked': len(results),
+                'violations': sum(1 for r in results if r['hasViolation']),
+                'persisted': sum(1 for r in results if r['persisted']),
+                'missing': len(missing),
+                'durationMs': round((time.perf_counter() - started) * 1000, 1)
+            }}))
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/x-ndjson', 'Access-Control-Allow-Origin': '*'},
+                'body': '\n'.join(lines) + '\n',
+                'isBase64Encoded': False
+            }
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'Ошибка анализа: {str(e)}'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+    
     material_id = body.get('materialId')
     
     if not material_id:
@@ -58,85 +285,7 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
-        database_url = os.environ.get('DATABASE_URL')
-        if not database_url:
-            has_violation = False
-            violation_code = None
-            violation_type = None
-            confidence = 50.0
-            reasoning = "DATABASE_URL не настроен"
-            training_count = 0
-            base_confidence = 50.0
-        else:
-            conn = psycopg2.connect(database_url)
-            cur = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cur.execute('''
-                SELECT accuracy, precision_score, recall_score, training_samples_count 
-                FROM t_p28865948_photo_material_proce.ai_training_metrics 
-                ORDER BY training_date DESC 
-                LIMIT 1
-            ''')
-            metrics = cur.fetchone()
-            
-            base_confidence = float(metrics['accuracy']) * 100 if metrics else 75.0
-            training_count = int(metrics['training_samples_count']) if metrics else 0
-            
-            cur.execute('''
-                SELECT violation_code, notes, COUNT(*) as frequency 
-                FROM t_p28865948_photo_material_proce.violation_markups 
-                WHERE is_training_data = true 
-                GROUP BY violation_code, notes 
-                ORDER BY frequency DESC 
-                LIMIT 20
-            ''')
-            training_patterns = cur.fetchall()
-            
-            cur.close()
-            conn.close()
-            
-            if training_count == 0 or not training_patterns:
-                has_violation = False
-                violation_code = None
-                violation_type = None
-                confidence = 50.0
-                reasoning = "Недостаточно обучающих данных для анализа"
-            else:
-                has_violation_probability = min(0.7, training_count / 50)
-                has_violation = random.random() < has_violation_probability
-                
-                if has_violation:
-                    pattern = random.choice(training_patterns)
-                    violation_code = pattern['violation_code']
-                    violation_type = pattern['notes'] or f"Нарушение {violation_code}"
-                    
-                    confidence_boost = min(15, training_count * 0.5)
-                    confidence = min(95.0, base_confidence + confidence_boost + random.uniform(-5, 5))
-                    
-                    reasoning = f"Обнаружено сходство с {pattern['frequency']} обучающими примерами. База: {training_count} материалов, точность модели: {base_confidence:.1f}%"
-                else:
-                    violation_code = None
-                    violation_type = None
-                    confidence = base_confidence + random.uniform(-10, 5)
-                    reasoning = f"Нарушений не обнаружено. Анализ основан на {training_count} обучающих материалах"
-        
-        detected_objects = [
-            {"type": "vehicle", "description": "транспортное средство"}
-        ]
-        
-        if has_violation:
-            detected_objects.append({"type": "violation", "description": "нарушение ПДД"})
-        
-        result = {
-            "hasViolation": has_violation,
-            "violationCode": violation_code,
-            "violationType": violation_type,
-            "confidence": round(confidence, 1),
-            "detectedObjects": detected_objects,
-            "reasoning": reasoning,
-            "modelVersion": base_confidence / 100.0,
-            "trainingSamples": training_count
-        }
+        result = check_single(material_id)
 
         return {
             'statusCode': 200,
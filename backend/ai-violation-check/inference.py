@@ -0,0 +1,166 @@
+import zlib
+
+REGION_TYPES = ('vehicle', 'plate', 'signal', 'sign', 'seatbelt', 'headlight', 'other')
+PARAMETER_BUCKETS = 8
+REGION_STATS = 5
+FEATURE_SIZE = len(REGION_TYPES) * REGION_STATS + 2 + PARAMETER_BUCKETS * 2
+NO_VIOLATION = ''
+QUERY_CHUNK = 1024
+DISTANCE_BUDGET = 16 * 1024 * 1024
+
+FEATURE_ROWS_SQL = '''
+    SELECT material_id, 'region' AS kind, region_type AS name, x, y, width, height, NULL AS value
+    FROM {prefix}markup_regions
+    WHERE material_id = ANY(%(ids)s)
+    UNION ALL
+    SELECT vm.material_id, 'parameter', vp.parameter_id, NULL, NULL, NULL, NULL, vp.value
+    FROM {prefix}violation_parameters vp
+    JOIN {prefix}violation_markups vm ON vm.id = vp.markup_id
+    WHERE vm.material_id = ANY(%(ids)s)
+'''
+
+TRAINING_LABELS_SQL = '''
+    SELECT id, material_id, COALESCE(violation_code, '') AS violation_code, notes, updated_at
+    FROM {prefix}violation_markups
+    WHERE is_training_data = TRUE
+    ORDER BY id
+'''
+
+def parameter_value(value) -> float:
+    try:
+        return float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return 1.0
+
+def feature_vector(regions: list, parameters: list) -> list:
+    '''Фиксированный вектор признаков материала: по каждому типу региона — число, суммарная площадь,
+    средний центр (x, y) и максимальная площадь; общее число регионов и их суммарная площадь;
+    параметры нарушения хэшируются в PARAMETER_BUCKETS корзин (наличие и числовое значение)'''
+    vector = [0.0] * FEATURE_SIZE
+    total_area = 0.0
+    for region in regions:
+        name = region['name'] if region['name'] in REGION_TYPES else 'other'
+        slot = REGION_TYPES.index(name) * REGION_STATS
+        width, height = float(region['width']), float(region['height'])
+        area = width * height
+        vector[slot] += 1
+        vector[slot + 1] += area
+        vector[slot + 2] += float(region['x']) + width / 2
+        vector[slot + 3] += float(region['y']) + height / 2
+        vector[slot + 4] = max(vector[slot + 4], area)
+        total_area += area
+    for slot in range(0, len(REGION_TYPES) * REGION_STATS, REGION_STATS):
+        if vector[slot]:
+            vector[slot + 2] /= vector[slot]
+            vector[slot + 3] /= vector[slot]
+    base = len(REGION_TYPES) * REGION_STATS
+    vector[base] = len(regions)
+    vector[base + 1] = total_area
+    for parameter in parameters:
+        bucket = base + 2 + (zlib.crc32(str(parameter['name']).encode()) % PARAMETER_BUCKETS) * 2
+        vector[bucket] += 1
+        vector[bucket + 1] += parameter_value(parameter['value'])
+    return vector
+
+def load_feature_rows(cursor, material_ids: list, prefix: str = '') -> dict:
+    '''Регионы и параметры нарушений для набора материалов одним запросом: {id: {'regions': [...], 'parameters': [...]}}'''
+    entries = {material_id: {'regions': [], 'parameters': []} for material_id in material_ids}
+    if not material_ids:
+        return entries
+    cursor.execute(FEATURE_ROWS_SQL.format(prefix=prefix), {'ids': list(material_ids)})
+    for row in cursor.fetchall():
+        entry = entries.get(row['material_id'])
+        if entry is not None:
+            entry['regions' if row['kind'] == 'region' else 'parameters'].append(row)
+    return entries
+
+def feature_matrix(entries: dict, material_ids: list) -> 'numpy.ndarray':
+    import numpy as np
+    rows = [feature_vector(entries[m]['regions'], entries[m]['parameters']) for m in material_ids]
+    return np.array(rows, dtype=np.float32).reshape(len(material_ids), FEATURE_SIZE)
+
+def load_training_set(cursor, prefix: str = '') -> tuple:
+    '''Матрица признаков и метки (код нарушения, '' — без нарушения) всех обучающих разметок'''
+    cursor.execute(TRAINING_LABELS_SQL.format(prefix=prefix))
+    labelled = cursor.fetchall()
+    material_ids = [row['material_id'] for row in labelled]
+    entries = load_feature_rows(cursor, material_ids, prefix)
+    notes = {}
+    for row in labelled:
+        if row['violation_code'] and row['notes']:
+            notes.setdefault(row['violation_code'], row['notes'])
+    return feature_matrix(entries, material_ids), [row['violation_code'] for row in labelled], notes
+
+class KnnModel:
+    '''k ближайших соседей по нормализованным признакам; голоса взвешены обратным расстоянием'''
+
+    def __init__(self, features: 'numpy.ndarray', label_ids: 'numpy.ndarray', classes: list, mean: 'numpy.ndarray', scale: 'numpy.ndarray', k: int, norms=None):
+        import numpy as np
+        self.features = features
+        self.label_ids = label_ids
+        self.classes = classes
+        self.mean = mean
+        self.scale = scale
+        self.k = k
+        self.norms = np.einsum('ij,ij->i', features, features) if norms is None else norms
+
+    @classmethod
+    def fit(cls, features: 'numpy.ndarray', labels: list, k: int = 5) -> 'KnnModel':
+        import numpy as np
+        classes = sorted(set(labels))
+        index = {label: i for i, label in enumerate(classes)}
+        return cls.fit_encoded(features, np.array([index[label] for label in labels], dtype=np.int32), classes, k)
+
+    @classmethod
+    def fit_encoded(cls, features: 'numpy.ndarray', label_ids: 'numpy.ndarray', classes: list, k: int = 5) -> 'KnnModel':
+        '''Метки уже закодированы индексами в classes'''
+        import numpy as np
+        mean = features.mean(axis=0) if len(features) else np.zeros(FEATURE_SIZE, dtype=np.float32)
+        scale = features.std(axis=0) if len(features) else np.ones(FEATURE_SIZE, dtype=np.float32)
+        scale[scale == 0] = 1.0
+        normalized = ((features - mean) / scale).astype(np.float32)
+        return cls(normalized, label_ids.astype(np.int32), classes, mean.astype(np.float32), scale.astype(np.float32), k)
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def predict(self, queries: 'numpy.ndarray') -> list:
+        '''Для каждой строки — (метка, доля взвешенных голосов, число соседей с этой меткой)'''
+        import numpy as np
+        results = []
+        k = min(self.k, len(self.features))
+        # матрица расстояний порции не превышает DISTANCE_BUDGET элементов при любом размере обучающей выборки
+        step = max(1, min(QUERY_CHUNK, DISTANCE_BUDGET // len(self.features)))
+        for start in range(0, len(queries), step):
+            chunk = ((queries[start:start + step] - self.mean) / self.scale).astype(np.float32)
+            # |q|² одинаков для всей строки и не меняет порядок соседей — добавляется только к выбранным k
+            distances = self.norms[None, :] - 2 * chunk @ self.features.T
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < len(self.features) else np.tile(np.arange(k), (len(chunk), 1))
+            nearest_distances = np.take_along_axis(distances, nearest, axis=1) + np.einsum('ij,ij->i', chunk, chunk)[:, None]
+            np.maximum(nearest_distances, 0, out=nearest_distances)
+            weights = 1.0 / (np.sqrt(nearest_distances) + 1e-6)
+            votes = np.zeros((len(chunk), len(self.classes)), dtype=np.float64)
+            np.add.at(votes, (np.arange(len(chunk))[:, None], self.label_ids[nearest]), weights)
+            winners = votes.argmax(axis=1)
+            shares = votes[np.arange(len(chunk)), winners] / votes.sum(axis=1)
+            support = (self.label_ids[nearest] == winners[:, None]).sum(axis=1)
+            results.extend(zip((self.classes[w] for w in winners), shares.tolist(), support.tolist()))
+        return results
+
+def build_model(cursor, prefix: str = '', k: int = 5) -> dict:
+    '''Модель по текущим обучающим разметкам: {'model': KnnModel или None, 'notes': {код: описание}, 'samples': n}'''
+    features, labels, notes = load_training_set(cursor, prefix)
+    model = KnnModel.fit(features, labels, k) if labels else None
+    return {'model': model, 'notes': notes, 'samples': len(labels)}
+
+def classify_materials(cursor, model, material_ids: list, prefix: str = '') -> dict:
+    '''{id: {'label', 'share', 'support', 'regions'}}; label None — у материала нет разметки регионов и параметров
+    или модель ещё не обучена. Все материалы оцениваются одним матричным проходом'''
+    entries = load_feature_rows(cursor, material_ids, prefix)
+    marked = [m for m in material_ids if entries[m]['regions'] or entries[m]['parameters']]
+    results = {m: {'label': None, 'share': 0.0, 'support': 0, 'regions': entries[m]['regions']} for m in material_ids}
+    if model is None or not len(model) or not marked:
+        return results
+    for material_id, (label, share, support) in zip(marked, model.predict(feature_matrix(entries, marked))):
+        results[material_id].update(label=label, share=share, support=support)
+    return results
@@ -0,0 +1,125 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import random
+import cProfile
+from collections import Counter
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'pstats')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '2')) / 1000
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+PROFILING_ENABLED = bool(PROFILE_DIR) and (PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN))
+
+_active = threading.Lock()
+_index_lock = threading.Lock()
+
+def should_profile(event: dict) -> bool:
+    '''Профилируется доля PROFILE_SAMPLE_RATE вызовов и запросы с заголовком X-Profile, равным PROFILE_TOKEN'''
+    if PROFILE_TOKEN:
+        for key, value in (event.get('headers') or {}).items():
+            if key.lower() == 'x-profile' and value == PROFILE_TOKEN:
+                return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+class StackSampler:
+    '''Сэмплирующий профилировщик: раз в interval снимает стек потока handler'а и копит свёрнутые стеки'''
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+def safe_name(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value))[:64] or 'unknown'
+
+def run_profiled(function: str, action: str, request_id: str, call):
+    '''Выполняет call() под профилировщиком и пишет pstats или свёрнутые стеки в PROFILE_DIR/<функция>/<action>/.
+    Одновременно профилируется только один вызов в процессе, остальные выполняются как обычно'''
+    if not _active.acquire(blocking=False):
+        return call()
+    try:
+        if PROFILE_FORMAT == 'collapsed':
+            profiler = StackSampler(PROFILE_INTERVAL)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            duration = time.perf_counter() - started
+            if PROFILE_FORMAT == 'collapsed':
+                profiler.stop()
+            else:
+                profiler.disable()
+            try:
+                save_profile(profiler, function, action, request_id, duration)
+            except OSError as e:
+                # недоступный или переполненный PROFILE_DIR не должен ломать ответ handler'а
+                sys.stderr.write(json.dumps({'type': 'profile_error', 'function': function, 'action': action,
+                                             'requestId': request_id, 'error': str(e)}, ensure_ascii=False) + '\n')
+    finally:
+        _active.release()
+
+def save_profile(profiler, function: str, action: str, request_id: str, duration: float) -> None:
+    action_dir = os.path.join(PROFILE_DIR, safe_name(function), safe_name(action))
+    os.makedirs(action_dir, exist_ok=True)
+    extension = 'folded' if PROFILE_FORMAT == 'collapsed' else 'prof'
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{int(time.time() * 1000) % 1000:03d}-{safe_name(request_id)}.{extension}'
+    if PROFILE_FORMAT == 'collapsed':
+        profiler.dump(os.path.join(action_dir, name))
+    else:
+        profiler.dump_stats(os.path.join(action_dir, name))
+
+    for stale in sorted(os.listdir(action_dir))[:-PROFILE_KEEP]:
+        os.remove(os.path.join(action_dir, stale))
+
+    entry = {'file': f'{safe_name(action)}/{name}', 'requestId': request_id, 'durationMs': round(duration * 1000, 2),
+             'format': PROFILE_FORMAT, 'createdAt': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    update_index(os.path.join(PROFILE_DIR, safe_name(function), 'index.json'), action, entry)
+
+def update_index(path: str, action: str, entry: dict) -> None:
+    '''index.json: для каждого action — последние PROFILE_KEEP профилей, новые первыми'''
+    with _index_lock:
+        try:
+            with open(path, encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index[action] = ([entry] + index.get(action, []))[:PROFILE_KEEP]
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
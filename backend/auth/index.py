@@ -1,10 +1,10 @@
 import json
-import os
 import hashlib
 import secrets
 from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_connection, release_connection, dict_cursor
+from response import negotiated_compression
+from tracing import traced
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -13,8 +13,10 @@ def generate_session_token() -> str:
     return secrets.token_urlsafe(32)
 
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    return get_connection()
 
+@traced
+@negotiated_compression
 def handler(event: dict, context) -> dict:
     '''API для аутентификации: регистрация, вход, проверка сессии, выход'''
     method = event.get('httpMethod', 'GET')
@@ -76,7 +78,7 @@ def register(event: dict) -> dict:
     
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with dict_cursor(conn) as cur:
             cur.execute("SELECT id FROM users WHERE email = %s", (email,))
             if cur.fetchone():
                 return {
@@ -103,7 +105,7 @@ def register(event: dict) -> dict:
                 })
             }
     finally:
-        conn.close()
+        release_connection(conn)
 
 def login(event: dict) -> dict:
     data = json.loads(event.get('body', '{}'))
@@ -115,7 +117,7 @@ def login(event: dict) -> dict:
     
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with dict_cursor(conn) as cur:
             password_hash = hash_password(password)
             cur.execute(
                 "SELECT id, email, full_name, role, is_blocked, is_approved FROM users WHERE email = %s AND password_hash = %s AND is_archived = FALSE",
@@ -194,7 +196,7 @@ def login(event: dict) -> dict:
                 })
             }
     finally:
-        conn.close()
+        release_connection(conn)
 
 def logout(event: dict) -> dict:
     auth_header = event.get('headers', {}).get('x-authorization', '') or event.get('headers', {}).get('authorization', '')
@@ -219,7 +221,7 @@ def logout(event: dict) -> dict:
                 'body': json.dumps({'success': True})
             }
     finally:
-        conn.close()
+        release_connection(conn)
 
 def verify_session(event: dict) -> dict:
     auth_header = event.get('headers', {}).get('x-authorization', '') or event.get('headers', {}).get('authorization', '')
@@ -234,7 +236,7 @@ def verify_session(event: dict) -> dict:
     
     conn = get_db_connection()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with dict_cursor(conn) as cur:
             cur.execute(
                 """SELECT u.id, u.email, u.full_name, u.role, u.is_blocked, u.is_approved 
                    FROM user_sessions s 
@@ -267,4 +269,4 @@ def verify_session(event: dict) -> dict:
                 })
             }
     finally:
-        conn.close()
\ No newline at end of file
+        release_connection(conn)
\ No newline at end of file
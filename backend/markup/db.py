@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+from tracing import tracing_connection_class, span
+
+psycopg2 = None
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '300'))
+POOL_HEALTH_CHECK_IDLE = float(os.environ.get('DB_POOL_HEALTH_CHECK_IDLE', '30'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+class ConnectionPool:
+    '''Пул соединений уровня модуля: переживает тёплые вызовы функции, проверяет простаивавшие
+    соединения через SELECT 1, пересоздаёт их по истечении max_lifetime и откатывает незавершённые транзакции при возврате'''
+
+    def __init__(self, dsn: str, max_size: int, max_lifetime: float, health_check_idle: float):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_idle = health_check_idle
+        self._idle = []
+        self._born = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + POOL_ACQUIRE_TIMEOUT
+        while True:
+            with self._cond:
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise psycopg2.OperationalError('Connection pool exhausted')
+                    self._cond.wait(remaining)
+                    continue
+            if candidate is None:
+                return self._connect()
+            conn, last_used = candidate
+            if self._healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn) -> None:
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=tracing_connection_class())
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        now = time.monotonic()
+        if conn.closed or now - self._born.get(id(conn), now) > self.max_lifetime:
+            return False
+        if now - last_used > self.health_check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._cond.notify()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    '''psycopg2 импортируется при первом обращении к пулу, чтобы OPTIONS и ошибки валидации не платили за него на холодном старте'''
+    global _pool, psycopg2
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                import psycopg2
+                import psycopg2.extensions
+                _pool = ConnectionPool(os.environ['DATABASE_URL'], POOL_MAX_SIZE, POOL_MAX_LIFETIME, POOL_HEALTH_CHECK_IDLE)
+    return _pool
+
+def get_connection():
+    with span('connect'):
+        return get_pool().acquire()
+
+def release_connection(conn) -> None:
+    get_pool().release(conn)
+
+def dict_cursor(conn, name=None):
+    '''Курсор со строками-словарями; с name — серверный (именованный) курсор для чтения порциями'''
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(name=name, cursor_factory=RealDictCursor)
@@ -1,9 +1,12 @@
 import json
 import os
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_connection, release_connection, dict_cursor
+from response import columnar, wants_columnar, dumps, negotiated_compression
+from tracing import traced
 
+@traced
+@negotiated_compression
 def handler(event: dict, context) -> dict:
     '''API для управления разметкой материалов'''
     method = event.get('httpMethod', 'GET')
@@ -28,8 +31,8 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        conn = get_connection()
+        cursor = dict_cursor(conn)
         
         if method == 'GET':
             material_id = event.get('queryStringParameters', {}).get('material_id')
@@ -91,6 +94,14 @@ def handler(event: dict, context) -> dict:
                 ''')
                 markups = cursor.fetchall()
                 
+                if wants_columnar(event):
+                    names = [column.name for column in cursor.description]
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': dumps({'markups': columnar(names, markups)})
+                    }
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -244,4 +255,4 @@ def handler(event: dict, context) -> dict:
         if 'cursor' in locals():
             cursor.close()
         if 'conn' in locals():
-            conn.close()
+            release_connection(conn)
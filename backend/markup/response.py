@@ -0,0 +1,187 @@
+import os
+import json
+import base64
+import threading
+import functools
+import gzip
+from collections import OrderedDict
+from datetime import datetime, date
+from decimal import Decimal
+from tracing import span
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+COMPRESSION_CACHE_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_CACHE_SIZE', '32'))
+
+_compression_cache = OrderedDict()
+_compression_cache_lock = threading.Lock()
+_brotli = False
+
+def _iso(value):
+    return value.isoformat()
+
+CONVERTERS = (
+    (bool, None, 'boolean'),
+    (int, None, 'integer'),
+    (float, None, 'number'),
+    (str, None, 'string'),
+    (datetime, _iso, 'datetime'),
+    (date, _iso, 'date'),
+    (Decimal, float, 'number'),
+    ((dict, list), None, 'json')
+)
+
+def column_converter(values) -> tuple:
+    '''Конвертер выбирается один раз на колонку по первому непустому значению'''
+    for value in values:
+        if value is None:
+            continue
+        for kind, converter, type_name in CONVERTERS:
+            if isinstance(value, kind):
+                return converter, type_name
+        return str, 'string'
+    return None, 'null'
+
+def convert_column(values: list, converter) -> list:
+    if converter is None:
+        return list(values)
+    return [None if v is None else converter(v) for v in values]
+
+def row_values(names: list, rows: list) -> list:
+    if rows and isinstance(rows[0], dict):
+        return [[row[name] for name in names] for row in rows]
+    return rows
+
+def rows_to_dicts(names: list, rows: list) -> list:
+    '''Строки в формате списка объектов с теми же конвертерами, что и в колоночном режиме'''
+    rows = row_values(names, rows)
+    columns = [convert_column(col, column_converter(col)[0]) for col in zip(*rows)] if rows else []
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+def columnar(names: list, rows: list) -> dict:
+    '''Компактный формат: схема и по одному массиву на колонку вместо повторения ключей в каждой строке'''
+    rows = row_values(names, rows)
+    raw_columns = list(zip(*rows)) if rows else [() for _ in names]
+    schema = []
+    columns = []
+    for name, values in zip(names, raw_columns):
+        converter, type_name = column_converter(values)
+        schema.append({'name': name, 'type': type_name})
+        columns.append(convert_column(values, converter))
+    return {'format': 'columnar', 'schema': schema, 'rowCount': len(rows), 'columns': columns}
+
+def wants_columnar(event: dict, body: dict = None) -> bool:
+    params = event.get('queryStringParameters') or {}
+    return (body or {}).get('format', params.get('format')) == 'columnar'
+
+def dumps(payload) -> str:
+    with span('encode'):
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+def get_header(event: dict, name: str):
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def brotli_module():
+    '''brotli (необязательная зависимость) импортируется при первом сжатии'''
+    global _brotli
+    if _brotli is False:
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        _brotli = brotli
+    return _brotli
+
+def negotiate_encoding(accept_encoding: str):
+    '''Выбор br/gzip по Accept-Encoding с учётом q-значений'''
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[token.strip().lower()] = quality
+    candidates = ['br', 'gzip'] if brotli_module() is not None else ['gzip']
+    best = None
+    for encoding in candidates:
+        quality = weights.get(encoding, weights.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli_module().compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    '''Сжатое представление — отдельный ресурс для кэшей (RFC 9110 8.8.3): "<hash>" -> "<hash>-br"'''
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+def matching_etag(event: dict, etag: str):
+    '''Тег из If-None-Match, совпавший с ETag ответа в любой из кодировок; сравнение слабое, W/ допускается.
+    Его и нужно вернуть в ETag ответа 304'''
+    header = get_header(event, 'If-None-Match')
+    if not header:
+        return None
+    variants = {etag} | {encoded_etag(etag, encoding) for encoding in ('br', 'gzip')}
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/') in variants:
+            return etag if tag == '*' else tag
+    return None
+
+def compress_response(event: dict, response: dict) -> dict:
+    '''Сжимает тело больше порога; для ответов с ETag сжатое тело кэшируется по (ETag, кодировка),
+    а ETag получает суффикс кодировки'''
+    body = response.get('body')
+    if not isinstance(body, str) or response.get('isBase64Encoded') or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    headers = dict(response.get('headers') or {})
+    etag = headers.get('ETag')
+    cache_key = (etag, encoding) if etag else None
+    compressed = None
+    if cache_key:
+        with _compression_cache_lock:
+            compressed = _compression_cache.get(cache_key)
+            if compressed is not None:
+                _compression_cache.move_to_end(cache_key)
+    if compressed is None:
+        with span('compress'):
+            compressed = compress_body(body.encode('utf-8'), encoding)
+        if cache_key:
+            with _compression_cache_lock:
+                _compression_cache[cache_key] = compressed
+                while len(_compression_cache) > COMPRESSION_CACHE_SIZE:
+                    _compression_cache.popitem(last=False)
+
+    if etag:
+        headers['ETag'] = encoded_etag(etag, encoding)
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def negotiated_compression(handler):
+    @functools.wraps(handler)
+    def wrapper(event: dict, context) -> dict:
+        return compress_response(event, handler(event, context))
+    return wrapper
@@ -0,0 +1,117 @@
+import os
+import io
+import base64
+import hashlib
+import tempfile
+
+# inline — превью остаются data URL в строке материала; local — файлы в BLOB_STORE_DIR, которые должны отдаваться
+# по BLOB_BASE_URL (location /blobs/ в nginx.conf или маршрут /blobs/ в scripts/gateway.py)
+BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'inline')
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', '/var/lib/trafficvision/blobs')
+BLOB_BASE_URL = os.environ.get('BLOB_BASE_URL', '/blobs').rstrip('/')
+THUMBNAIL_SIZE = int(os.environ.get('BLOB_THUMBNAIL_SIZE', '320'))
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+
+class LocalBlobStore:
+    '''Контентно-адресуемое хранилище превью на локальной файловой системе'''
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url
+
+    def key_for(self, digest: str, suffix: str) -> str:
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{suffix}'
+
+    def url_for(self, key: str) -> str:
+        return f'{self.base_url}/{key}'
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.root, key))
+
+    def put(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.root, key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # уникальный временный файл: один и тот же ключ могут писать несколько потоков и процессов
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            f.write(data)
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.unlink(f.name)
+            raise
+
+def get_blob_store():
+    '''Хранилище превью или None, если превью хранятся inline'''
+    if BLOB_STORE_BACKEND == 'inline':
+        return None
+    if BLOB_STORE_BACKEND != 'local':
+        raise ValueError(f'Unsupported blob store backend: {BLOB_STORE_BACKEND}')
+    return LocalBlobStore(BLOB_STORE_DIR, BLOB_BASE_URL)
+
+def is_inline_preview(value) -> bool:
+    return isinstance(value, str) and value.startswith('data:')
+
+def decode_data_url(value: str) -> tuple:
+    header, _, payload = value.partition(',')
+    content_type = header[5:].split(';')[0] or 'application/octet-stream'
+    if ';base64' in header:
+        return content_type, base64.b64decode(payload, validate=True)
+    return content_type, payload.encode()
+
+def make_thumbnail(data: bytes):
+    '''Уменьшенная JPEG-копия; без Pillow миниатюра не создаётся'''
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert('RGB')
+            image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            out = io.BytesIO()
+            image.save(out, format='JPEG', quality=80, optimize=True)
+            return out.getvalue()
+    except Exception:
+        return None
+
+def store_blob(data: bytes, content_type: str, store: LocalBlobStore, thumbnail: bool = True) -> dict:
+    '''Сохраняет байты один раз по SHA-256; миниатюра создаётся только при первой записи'''
+    digest = hashlib.sha256(data).hexdigest()
+    key = store.key_for(digest, '.' + EXTENSIONS.get(content_type, 'bin'))
+    thumb_key = store.key_for(digest, '_thumb.jpg')
+
+    store.put(key, data)
+    thumbnail_url = None
+    if thumbnail and store.exists(thumb_key):
+        thumbnail_url = store.url_for(thumb_key)
+    elif thumbnail:
+        thumbnail_data = make_thumbnail(data)
+        if thumbnail_data is not None:
+            store.put(thumb_key, thumbnail_data)
+            thumbnail_url = store.url_for(thumb_key)
+
+    return {
+        'preview_url': store.url_for(key),
+        'preview_hash': digest,
+        'thumbnail_url': thumbnail_url
+    }
+
+def store_preview(value, store: LocalBlobStore = None) -> dict:
+    '''Сохраняет inline-превью (data URL) в хранилище и возвращает ссылки для строки материала.
+    Обычные URL, а без настроенного хранилища и data URL, возвращаются без изменений'''
+    if not is_inline_preview(value):
+        return {'preview_url': value, 'preview_hash': None, 'thumbnail_url': None}
+
+    store = store or get_blob_store()
+    if store is None:
+        return {'preview_url': value, 'preview_hash': None, 'thumbnail_url': None}
+    content_type, data = decode_data_url(value)
+    return store_blob(data, content_type, store)
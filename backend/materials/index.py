@@ -1,8 +1,433 @@
 import json
 import os
-import psycopg2
+import base64
+import time
+import hashlib
 from datetime import datetime
+from blob_store import get_blob_store, store_preview
+from db import get_connection, release_connection
+from purge import purge_batch
+from response import columnar, rows_to_dicts, wants_columnar, dumps, matching_etag, negotiated_compression
+from tracing import traced
 
+MATERIAL_FIELDS = {
+    'id': 'id',
+    'fileName': 'file_name',
+    'timestamp': 'timestamp',
+    'preview': 'preview_url',
+    'previewHash': 'preview_hash',
+    'thumbnail': 'thumbnail_url',
+    'status': 'status',
+    'violationType': 'violation_type',
+    'violationCode': 'violation_code',
+    'createdAt': 'created_at',
+    'updatedAt': 'updated_at'
+}
+
+MAX_PAGE_SIZE = 1000
+PREVIEW_MIGRATION_BATCH = 100
+BULK_CHUNK_SIZE = int(os.environ.get('MATERIALS_BULK_CHUNK_SIZE', '500'))
+MAX_BULK_CHUNK_SIZE = 5000
+MATERIAL_STATUSES = ('pending', 'violation', 'clean', 'analytics', 'processed')
+
+PURGE_BATCH_SIZE = 1000
+PURGE_TIME_BUDGET = float(os.environ.get('MATERIALS_PURGE_TIME_BUDGET', '20'))
+
+SCHEMA = 't_p28865948_photo_material_proce.'
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_FIELDS = {
+    'fileName': 'file_name',
+    'violationType': 'violation_type'
+}
+
+UPDATE_FIELDS = {
+    'status': 'status',
+    'violationCode': 'violation_code',
+    'violationType': 'violation_type'
+}
+
+BULK_UPSERT_SQL = '''
+    INSERT INTO t_p28865948_photo_material_proce.materials 
+    (id, file_name, timestamp, preview_url, preview_hash, thumbnail_url, status, violation_type, violation_code)
+    VALUES %s
+    ON CONFLICT (id) DO UPDATE SET
+        status = EXCLUDED.status,
+        violation_code = EXCLUDED.violation_code,
+        violation_type = EXCLUDED.violation_type,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING id, (xmax = 0) AS inserted
+'''
+
+def encode_cursor(*values) -> str:
+    '''Непрозрачный курсор keyset-пагинации: (timestamp, id) для списка, (watermark, change_xid, id) для дельты'''
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> list:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+def resolve_fields(fields) -> list:
+    '''Проекция колонок: id и timestamp нужны всегда для курсора (fetch_page ищет их по имени поля)'''
+    if not fields:
+        return list(MATERIAL_FIELDS.keys())
+    unknown = [f for f in fields if f not in MATERIAL_FIELDS]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    return ['id', 'timestamp'] + [f for f in fields if f not in ('id', 'timestamp')]
+
+def format_materials(fields: list, rows: list, columnar_format: bool):
+    if columnar_format:
+        return columnar(fields, rows)
+    return rows_to_dicts(fields, rows)
+
+def fetch_page(cursor, fields: list, conditions: list, params: list, limit, cursor_value, paginate: bool, columnar_format: bool = False) -> dict:
+    limit = min(max(int(limit or MAX_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    conditions = list(conditions)
+    params = list(params)
+    if cursor_value:
+        timestamp, material_id = decode_cursor(cursor_value)
+        conditions.append('(timestamp, id) < (%s, %s)')
+        params.extend([datetime.fromisoformat(timestamp), material_id])
+    
+    columns = ', '.join(MATERIAL_FIELDS[f] for f in fields)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'''
+        SELECT {columns}
+        FROM t_p28865948_photo_material_proce.materials
+        {where}
+        ORDER BY timestamp DESC, id DESC
+    '''
+    if paginate:
+        query += ' LIMIT %s'
+        params.append(limit + 1)
+    
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if paginate and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[fields.index('timestamp')], last[fields.index('id')])
+    
+    result = {'materials': format_materials(fields, rows, columnar_format)}
+    if paginate:
+        result['nextCursor'] = next_cursor
+        result['hasMore'] = next_cursor is not None
+    return result
+
+def list_materials(cursor, fields: list, limit, cursor_value, columnar_format: bool = False) -> dict:
+    paginate = limit is not None or cursor_value is not None
+    return fetch_page(cursor, fields, [], [], limit, cursor_value, paginate, columnar_format)
+
+def like_pattern(text: str, mode: str) -> str:
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if mode == 'prefix':
+        return f'{escaped}%'
+    if mode == 'substring':
+        return f'%{escaped}%'
+    raise ValueError(f'Unknown search mode: {mode}')
+
+def search_materials(cursor, fields: list, body: dict, columnar_format: bool = False) -> dict:
+    '''Поиск по file_name/violation_type через ILIKE (trigram-индексы) с фильтрами и keyset-пагинацией'''
+    conditions = []
+    params = []
+    
+    query = (body.get('query') or '').strip()
+    if query:
+        pattern = like_pattern(query, body.get('mode', 'substring'))
+        search_in = body.get('searchIn') or ['fileName', 'violationType']
+        columns = [SEARCH_FIELDS[f] for f in search_in if f in SEARCH_FIELDS]
+        if not columns:
+            raise ValueError('searchIn must contain fileName or violationType')
+        conditions.append('(' + ' OR '.join(f'{c} ILIKE %s' for c in columns) + ')')
+        params.extend([pattern] * len(columns))
+    if body.get('status'):
+        conditions.append('status = %s')
+        params.append(body['status'])
+    if body.get('violationCode'):
+        conditions.append('violation_code = %s')
+        params.append(body['violationCode'])
+    if body.get('from'):
+        conditions.append('timestamp >= %s')
+        params.append(body['from'])
+    if body.get('to'):
+        conditions.append('timestamp < %s')
+        params.append(body['to'])
+    
+    return fetch_page(cursor, fields, conditions, params, body.get('limit', SEARCH_PAGE_SIZE), body.get('cursor'), True, columnar_format)
+
+def parse_watermark(value) -> str:
+    '''Водяной знак дельты — id транзакции (xid8) в виде строки; '0' — полная выгрузка для первой синхронизации'''
+    if not str(value).isdigit():
+        raise ValueError('changedSince must be a watermark returned by a previous list call')
+    return str(value)
+
+def delta_expired(cursor, changed_since: str) -> bool:
+    '''Надгробия, нужные дельте от changed_since, уже очищены по сроку хранения (см. purge.py).
+    Полной выгрузке от '0' надгробия не нужны'''
+    if parse_watermark(changed_since) == '0':
+        return False
+    cursor.execute('''
+        SELECT 1 FROM t_p28865948_photo_material_proce.material_tombstone_horizon
+        WHERE pruned_xid >= %s::xid8
+    ''', (parse_watermark(changed_since),))
+    return cursor.fetchone() is not None
+
+def list_changes(cursor, fields: list, changed_since: str, limit, cursor_value, columnar_format: bool = False) -> dict:
+    '''Дельта с момента watermark по порядку коммитов: строки и надгробия, записанные транзакциями с change_xid
+    не меньше watermark, одной keyset-выборкой по (change_xid, id). Новый watermark — xmin снимка первой страницы:
+    всё, что записано транзакциями раньше него, уже закоммичено и попало в эту дельту; остальное будет прислано
+    повторно в следующей. Страницы применяются по порядку, поэтому id, удалённый и снова созданный, придёт в
+    последнем состоянии; watermark переносится между страницами в курсоре'''
+    since = parse_watermark(changed_since)
+    limit = min(max(int(limit or MAX_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    condition = 'change_xid >= %s::xid8'
+    params = [since]
+    if cursor_value:
+        watermark, last_xid, last_id = decode_cursor(cursor_value)
+        condition += ' AND (change_xid, id) > (%s::xid8, %s)'
+        params.extend([parse_watermark(last_xid), last_id])
+    else:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text')
+        watermark = cursor.fetchone()[0]
+    
+    columns = ', '.join(MATERIAL_FIELDS[f] for f in fields)
+    tombstone_columns = ', '.join('id' if f == 'id' else 'NULL' for f in fields)
+    cursor.execute(f'''
+        SELECT change_xid, id AS change_id, FALSE AS deleted, {columns}
+        FROM t_p28865948_photo_material_proce.materials
+        WHERE {condition}
+        UNION ALL
+        SELECT change_xid, id, TRUE, {tombstone_columns}
+        FROM t_p28865948_photo_material_proce.material_tombstones
+        WHERE {condition}
+        ORDER BY change_xid, change_id
+        LIMIT %s
+    ''', params + params + [limit + 1])
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(watermark, rows[-1][0], rows[-1][1])
+    
+    return {
+        'materials': format_materials(fields, [row[3:] for row in rows if not row[2]], columnar_format),
+        'deleted': [row[1] for row in rows if row[2]],
+        'watermark': watermark,
+        'nextCursor': next_cursor,
+        'hasMore': next_cursor is not None
+    }
+
+def facet_stats(cursor, by_day: bool, date_from, date_to) -> dict:
+    '''Фасетные счётчики из material_facet_counts: стоимость пропорциональна числу фасетов, а не строк'''
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append('day >= %s')
+        params.append(date_from)
+    if date_to:
+        conditions.append('day < %s')
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    day_column = ', day' if by_day else ''
+    
+    cursor.execute(f'''
+        SELECT facet, value{day_column}, SUM(count)
+        FROM t_p28865948_photo_material_proce.material_facet_counts
+        {where}
+        GROUP BY facet, value{day_column}
+        HAVING SUM(count) > 0
+        ORDER BY facet{day_column}, SUM(count) DESC
+    ''', params)
+    
+    facets = {'status': [], 'violationCode': []}
+    total = 0
+    for row in cursor.fetchall():
+        facet, value, count = row[0], row[1], int(row[-1])
+        entry = {'value': value or None, 'count': count}
+        if by_day:
+            entry['day'] = row[2].isoformat()
+        if facet == 'status':
+            facets['status'].append(entry)
+            total += count
+        else:
+            facets['violationCode'].append(entry)
+    
+    return {'total': total, 'facets': facets}
+
+def validate_material(material) -> str:
+    if not isinstance(material, dict):
+        return 'Material must be an object'
+    if not material.get('id'):
+        return 'id is required'
+    if not material.get('fileName'):
+        return 'fileName is required'
+    if material.get('status', 'pending') not in MATERIAL_STATUSES:
+        return f'Invalid status: {material.get("status")}'
+    return None
+
+def material_row(material: dict) -> tuple:
+    preview = store_preview(material.get('preview'))
+    return (
+        material['id'],
+        material['fileName'],
+        material.get('timestamp'),
+        preview['preview_url'],
+        preview['preview_hash'] or material.get('previewHash'),
+        preview['thumbnail_url'] or material.get('thumbnail'),
+        material.get('status', 'pending'),
+        material.get('violationType'),
+        material.get('violationCode')
+    )
+
+def bulk_upsert_materials(cursor, materials: list, chunk_size: int) -> list:
+    '''Многострочный upsert чанками; ошибочный чанк повторяется построчно, чтобы одна плохая строка не отменяла весь пакет.
+    Превью декодируются и сохраняются до записи, битое превью отклоняет только свою строку'''
+    import psycopg2
+    from psycopg2.extras import execute_values
+    results = [None] * len(materials)
+    last_index = {}
+    for i, material in enumerate(materials):
+        reason = validate_material(material)
+        if reason:
+            material_id = material.get('id') if isinstance(material, dict) else None
+            results[i] = {'id': material_id, 'outcome': 'rejected', 'reason': reason}
+            continue
+        if material['id'] in last_index:
+            results[last_index[material['id']]] = {'id': material['id'], 'outcome': 'rejected', 'reason': 'Duplicate id in batch'}
+        last_index[material['id']] = i
+    
+    prepared = {}
+    for i in sorted(last_index.values()):
+        try:
+            prepared[i] = material_row(materials[i])
+        except (ValueError, OSError) as e:
+            results[i] = {'id': materials[i]['id'], 'outcome': 'rejected', 'reason': f'Invalid preview: {e}'}
+    
+    pending = list(prepared)
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        rows = [prepared[i] for i in chunk]
+        
+        cursor.execute('SAVEPOINT bulk_chunk')
+        try:
+            returned = execute_values(cursor, BULK_UPSERT_SQL, rows, page_size=len(rows), fetch=True)
+            cursor.execute('RELEASE SAVEPOINT bulk_chunk')
+        except psycopg2.Error:
+            cursor.execute('ROLLBACK TO SAVEPOINT bulk_chunk')
+            returned = []
+            for i, row in zip(chunk, rows):
+                cursor.execute('SAVEPOINT bulk_row')
+                try:
+                    returned += execute_values(cursor, BULK_UPSERT_SQL, [row], fetch=True)
+                    cursor.execute('RELEASE SAVEPOINT bulk_row')
+                except psycopg2.Error as e:
+                    cursor.execute('ROLLBACK TO SAVEPOINT bulk_row')
+                    results[i] = {'id': row[0], 'outcome': 'rejected', 'reason': (e.pgerror or str(e)).strip()}
+        
+        for material_id, inserted in returned:
+            results[last_index[material_id]] = {'id': material_id, 'outcome': 'inserted' if inserted else 'updated'}
+    
+    return results
+
+def bulk_update_materials(cursor, items: list) -> list:
+    '''Патчи группируются по набору изменяемых колонок; каждая группа — один UPDATE ... FROM (VALUES ...)'''
+    from psycopg2.extras import execute_values
+    results = {}
+    groups = {}
+    for item in items:
+        material_id = item.get('id') if isinstance(item, dict) else None
+        updates = item.get('updates') if isinstance(item, dict) else None
+        columns = tuple(f for f in UPDATE_FIELDS if f in updates) if isinstance(updates, dict) else ()
+        
+        reason = None
+        if not material_id or not isinstance(updates, dict):
+            reason = 'id and updates are required'
+        elif not columns:
+            reason = 'No updatable fields'
+        elif 'status' in updates and updates['status'] not in MATERIAL_STATUSES:
+            reason = f'Invalid status: {updates["status"]}'
+        
+        for group in groups.values():
+            group.pop(material_id, None)
+        if reason:
+            results[material_id] = {'id': material_id, 'outcome': 'rejected', 'reason': reason}
+            continue
+        results.pop(material_id, None)
+        groups.setdefault(columns, {})[material_id] = tuple(updates[f] for f in columns)
+    
+    for columns, patches in groups.items():
+        if not patches:
+            continue
+        names = [UPDATE_FIELDS[f] for f in columns]
+        set_clause = ', '.join(f'{name} = v.{name}' for name in names)
+        updated = execute_values(cursor, f'''
+            UPDATE t_p28865948_photo_material_proce.materials AS m
+            SET {set_clause}, updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, {', '.join(names)})
+            WHERE m.id = v.id
+            RETURNING m.id
+        ''', [(material_id,) + values for material_id, values in patches.items()], page_size=len(patches), fetch=True)
+        updated_ids = {row[0] for row in updated}
+        for material_id in patches:
+            if material_id in updated_ids:
+                results[material_id] = {'id': material_id, 'outcome': 'updated'}
+            else:
+                results[material_id] = {'id': material_id, 'outcome': 'not_found'}
+    
+    return list(results.values())
+
+def select_purge_batch(cursor, filters: dict, batch_size: int) -> list:
+    conditions = []
+    params = []
+    if filters.get('status'):
+        conditions.append('status = %s')
+        params.append(filters['status'])
+    if filters.get('from'):
+        conditions.append('timestamp >= %s')
+        params.append(filters['from'])
+    if filters.get('to'):
+        conditions.append('timestamp < %s')
+        params.append(filters['to'])
+    if not conditions:
+        raise ValueError('Purge filter needs status, from or to')
+    
+    cursor.execute(f'''
+        SELECT id FROM t_p28865948_photo_material_proce.materials
+        WHERE {' AND '.join(conditions)}
+        ORDER BY timestamp, id
+        LIMIT %s
+    ''', params + [batch_size])
+    return [row[0] for row in cursor.fetchall()]
+
+def purge_materials(conn, cursor, ids: list, filters: dict, batch_size: int) -> tuple:
+    '''Каждый пакет — отдельная короткая транзакция; по исчерпании бюджета времени возвращает has_more'''
+    started = time.monotonic()
+    purged = 0
+    offset = 0
+    while True:
+        if ids is not None:
+            batch = ids[offset:offset + batch_size]
+            offset += batch_size
+        else:
+            batch = select_purge_batch(cursor, filters, batch_size)
+        if not batch:
+            return purged, False
+        
+        purged += purge_batch(cursor, batch, SCHEMA)
+        conn.commit()
+        
+        if ids is not None and offset >= len(ids):
+            return purged, False
+        if time.monotonic() - started > PURGE_TIME_BUDGET:
+            return purged, True
+
+@traced
+@negotiated_compression
 def handler(event: dict, context) -> dict:
     '''API для управления материалами в базе данных'''
     method = event.get('httpMethod', 'GET')
@@ -13,7 +438,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Authorization, If-None-Match'
             },
             'body': ''
         }
@@ -22,60 +447,105 @@ def handler(event: dict, context) -> dict:
         body = json.loads(event.get('body', '{}')) if event.get('body') else {}
         action = body.get('action', 'list')
         
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cursor = conn.cursor()
         
         if action == 'list':
-            cursor.execute('''
-                SELECT id, file_name, timestamp, preview_url, status, 
-                       violation_type, violation_code, created_at, updated_at
-                FROM t_p28865948_photo_material_proce.materials
-                ORDER BY timestamp DESC
-            ''')
-            rows = cursor.fetchall()
-            materials = []
-            for row in rows:
-                materials.append({
-                    'id': row[0],
-                    'fileName': row[1],
-                    'timestamp': row[2].isoformat() if row[2] else None,
-                    'preview': row[3],
-                    'status': row[4],
-                    'violationType': row[5],
-                    'violationCode': row[6],
-                    'createdAt': row[7].isoformat() if row[7] else None,
-                    'updatedAt': row[8].isoformat() if row[8] else None
-                })
+            try:
+                fields = resolve_fields(body.get('fields'))
+                columnar_format = wants_columnar(event, body)
+                if body.get('changedSince') is not None:
+                    if delta_expired(cursor, body['changedSince']):
+                        return {
+                            'statusCode': 410,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'changedSince is older than retained tombstones, resync with changedSince 0'})
+                        }
+                    result = list_changes(cursor, fields, body['changedSince'], body.get('limit'), body.get('cursor'), columnar_format)
+                else:
+                    result = list_materials(cursor, fields, body.get('limit'), body.get('cursor'), columnar_format)
+            except (ValueError, TypeError) as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Invalid list parameters: {str(e)}'})
+                }
             
-            cursor.close()
-            conn.close()
+            response_body = dumps(result) if columnar_format else json.dumps(result)
+            if body.get('changedSince') is not None:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': response_body
+                }
+            
+            etag = f'"{hashlib.sha256(response_body.encode()).hexdigest()}"'
+            headers = {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag',
+                'ETag': etag
+            }
+            matched = matching_etag(event, etag)
+            if matched:
+                return {'statusCode': 304, 'headers': {**headers, 'ETag': matched}, 'body': ''}
+            
+            return {'statusCode': 200, 'headers': headers, 'body': response_body}
+        
+        elif action == 'search':
+            try:
+                fields = resolve_fields(body.get('fields'))
+                columnar_format = wants_columnar(event, body)
+                result = search_materials(cursor, fields, body, columnar_format)
+            except (ValueError, TypeError) as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Invalid search parameters: {str(e)}'})
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps(result) if columnar_format else json.dumps(result)
+            }
+        
+        elif action == 'stats':
+            result = facet_stats(cursor, bool(body.get('byDay')), body.get('from'), body.get('to'))
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'materials': materials})
+                'body': json.dumps(result)
             }
         
         elif action == 'create':
             material = body.get('material', {})
+            try:
+                preview = store_preview(material.get('preview'))
+            except (ValueError, OSError) as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Invalid preview: {e}'})
+                }
             cursor.execute('''
                 INSERT INTO t_p28865948_photo_material_proce.materials 
-                (id, file_name, timestamp, preview_url, status, violation_type, violation_code)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                (id, file_name, timestamp, preview_url, preview_hash, thumbnail_url, status, violation_type, violation_code)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING id
             ''', (
                 material['id'],
                 material['fileName'],
                 material.get('timestamp'),
-                material.get('preview'),
+                preview['preview_url'],
+                preview['preview_hash'],
+                preview['thumbnail_url'],
                 material.get('status', 'pending'),
                 material.get('violationType'),
                 material.get('violationCode')
             ))
             conn.commit()
-            cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -111,8 +581,6 @@ def handler(event: dict, context) -> dict:
             
             cursor.execute(query, values)
             conn.commit()
-            cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -120,56 +588,120 @@ def handler(event: dict, context) -> dict:
                 'body': json.dumps({'success': True})
             }
         
+        elif action == 'bulk_update':
+            items = body.get('items', [])
+            
+            results = bulk_update_materials(cursor, items)
+            
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': True,
+                    'updated': sum(1 for r in results if r['outcome'] == 'updated'),
+                    'results': results
+                })
+            }
+        
         elif action == 'delete':
             material_ids = body.get('ids', [])
-            placeholders = ', '.join(['%s'] * len(material_ids))
             
-            cursor.execute(f'''
-                DELETE FROM t_p28865948_photo_material_proce.materials 
-                WHERE id IN ({placeholders})
-            ''', material_ids)
+            deleted_count = purge_batch(cursor, material_ids, SCHEMA)
             
             conn.commit()
-            cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'deleted': len(material_ids)})
+                'body': json.dumps({'success': True, 'deleted': deleted_count})
+            }
+        
+        elif action == 'purge':
+            ids = body.get('ids')
+            filters = body.get('filter') or {}
+            batch_size = min(max(int(body.get('batchSize', PURGE_BATCH_SIZE)), 1), MAX_BULK_CHUNK_SIZE)
+            
+            if not ids and not filters:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'ids or filter is required'})
+                }
+            
+            try:
+                purged, has_more = purge_materials(conn, cursor, ids or None, filters, batch_size)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'purged': purged, 'hasMore': has_more})
             }
         
         elif action == 'bulk_create':
             materials = body.get('materials', [])
+            chunk_size = min(max(int(body.get('chunkSize', BULK_CHUNK_SIZE)), 1), MAX_BULK_CHUNK_SIZE)
+            
+            results = bulk_upsert_materials(cursor, materials, chunk_size)
+            
+            conn.commit()
+            
+            inserted = sum(1 for r in results if r['outcome'] == 'inserted')
+            updated = sum(1 for r in results if r['outcome'] == 'updated')
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'success': True,
+                    'count': inserted + updated,
+                    'inserted': inserted,
+                    'updated': updated,
+                    'rejected': len(results) - inserted - updated,
+                    'results': results
+                })
+            }
+        
+        elif action == 'migrate_previews':
+            store = get_blob_store()
+            if store is None:
+                return {
+                    'statusCode': 409,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Blob store is not configured, previews are kept inline'})
+                }
+            
+            batch_size = min(int(body.get('batchSize', PREVIEW_MIGRATION_BATCH)), MAX_PAGE_SIZE)
             
-            for material in materials:
+            cursor.execute('''
+                SELECT id, preview_url
+                FROM t_p28865948_photo_material_proce.materials
+                WHERE preview_hash IS NULL AND preview_url LIKE 'data:%%'
+                LIMIT %s
+            ''', (batch_size,))
+            rows = cursor.fetchall()
+            
+            for material_id, preview_url in rows:
+                preview = store_preview(preview_url, store)
                 cursor.execute('''
-                    INSERT INTO t_p28865948_photo_material_proce.materials 
-                    (id, file_name, timestamp, preview_url, status, violation_type, violation_code)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                        status = EXCLUDED.status,
-                        violation_code = EXCLUDED.violation_code,
-                        violation_type = EXCLUDED.violation_type,
-                        updated_at = CURRENT_TIMESTAMP
-                ''', (
-                    material['id'],
-                    material['fileName'],
-                    material.get('timestamp'),
-                    material.get('preview'),
-                    material.get('status', 'pending'),
-                    material.get('violationType'),
-                    material.get('violationCode')
-                ))
+                    UPDATE t_p28865948_photo_material_proce.materials
+                    SET preview_url = %s, preview_hash = %s, thumbnail_url = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND preview_url = %s
+                ''', (preview['preview_url'], preview['preview_hash'], preview['thumbnail_url'], material_id, preview_url))
             
             conn.commit()
-            cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True, 'count': len(materials)})
+                'body': json.dumps({'success': True, 'migrated': len(rows), 'hasMore': len(rows) == batch_size})
             }
         
         else:
@@ -185,3 +717,8 @@ def handler(event: dict, context) -> dict:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)})
         }
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            release_connection(conn)
@@ -0,0 +1,2 @@
+-- Составной индекс для keyset-пагинации списка материалов по (timestamp, id)
+CREATE INDEX IF NOT EXISTS idx_materials_timestamp_id ON materials(timestamp DESC, id DESC);
@@ -0,0 +1,5 @@
+-- Превью материалов хранятся в контентно-адресуемом хранилище, в строке остаются только хэш и ссылки
+ALTER TABLE materials ADD COLUMN IF NOT EXISTS preview_hash TEXT;
+ALTER TABLE materials ADD COLUMN IF NOT EXISTS thumbnail_url TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_materials_preview_hash ON materials(preview_hash);
@@ -0,0 +1,8 @@
+-- Надгробия удалённых материалов для дельта-синхронизации списка
+CREATE TABLE IF NOT EXISTS material_tombstones (
+    id TEXT PRIMARY KEY,
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_material_tombstones_deleted_at ON material_tombstones(deleted_at);
+CREATE INDEX IF NOT EXISTS idx_materials_updated_at ON materials(updated_at, id);
@@ -0,0 +1,72 @@
+-- Счётчики фасетов материалов (статус, код нарушения) по дням, поддерживаются триггерами
+CREATE TABLE IF NOT EXISTS material_facet_counts (
+    facet TEXT NOT NULL,
+    value TEXT NOT NULL,
+    day DATE NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (facet, value, day)
+);
+
+CREATE OR REPLACE FUNCTION apply_material_facet_delta() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO material_facet_counts (facet, value, day, count)
+        SELECT facet, value, day, SUM(delta) FROM (
+            SELECT 'status' AS facet, status AS value, timestamp::date AS day, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT 'violation_code', COALESCE(violation_code, ''), timestamp::date, 1 FROM new_rows
+        ) d
+        GROUP BY facet, value, day
+        ON CONFLICT (facet, value, day) DO UPDATE SET count = material_facet_counts.count + EXCLUDED.count;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO material_facet_counts (facet, value, day, count)
+        SELECT facet, value, day, SUM(delta) FROM (
+            SELECT 'status' AS facet, status AS value, timestamp::date AS day, -1 AS delta FROM old_rows
+            UNION ALL
+            SELECT 'violation_code', COALESCE(violation_code, ''), timestamp::date, -1 FROM old_rows
+        ) d
+        GROUP BY facet, value, day
+        ON CONFLICT (facet, value, day) DO UPDATE SET count = material_facet_counts.count + EXCLUDED.count;
+    ELSE
+        INSERT INTO material_facet_counts (facet, value, day, count)
+        SELECT facet, value, day, SUM(delta) FROM (
+            SELECT 'status' AS facet, status AS value, timestamp::date AS day, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT 'violation_code', COALESCE(violation_code, ''), timestamp::date, 1 FROM new_rows
+            UNION ALL
+            SELECT 'status', status, timestamp::date, -1 FROM old_rows
+            UNION ALL
+            SELECT 'violation_code', COALESCE(violation_code, ''), timestamp::date, -1 FROM old_rows
+        ) d
+        GROUP BY facet, value, day
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (facet, value, day) DO UPDATE SET count = material_facet_counts.count + EXCLUDED.count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS materials_facet_insert ON materials;
+CREATE TRIGGER materials_facet_insert
+    AFTER INSERT ON materials
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_material_facet_delta();
+
+DROP TRIGGER IF EXISTS materials_facet_update ON materials;
+CREATE TRIGGER materials_facet_update
+    AFTER UPDATE ON materials
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_material_facet_delta();
+
+DROP TRIGGER IF EXISTS materials_facet_delete ON materials;
+CREATE TRIGGER materials_facet_delete
+    AFTER DELETE ON materials
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_material_facet_delta();
+
+-- Начальное заполнение по существующим материалам
+TRUNCATE material_facet_counts;
+INSERT INTO material_facet_counts (facet, value, day, count)
+SELECT 'status', status, timestamp::date, COUNT(*) FROM materials GROUP BY status, timestamp::date
+UNION ALL
+SELECT 'violation_code', COALESCE(violation_code, ''), timestamp::date, COUNT(*) FROM materials GROUP BY COALESCE(violation_code, ''), timestamp::date;
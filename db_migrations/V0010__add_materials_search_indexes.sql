@@ -0,0 +1,7 @@
+-- Trigram-индексы для поиска материалов по подстроке и префиксу (ILIKE)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_materials_file_name_trgm ON materials USING GIN (file_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_materials_violation_type_trgm ON materials USING GIN (violation_type gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_materials_violation_code_timestamp ON materials(violation_code, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_materials_status_timestamp ON materials(status, timestamp DESC, id DESC);
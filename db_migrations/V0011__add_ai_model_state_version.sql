@@ -0,0 +1,20 @@
+-- Версия обучающего состояния модели: растёт при любом изменении разметки нарушений и при записи новых метрик.
+-- Кэши в функциях сравнивают её с сохранённой вместо повторной агрегации (чтение last_value почти бесплатно)
+CREATE SEQUENCE IF NOT EXISTS ai_model_state_version;
+
+CREATE OR REPLACE FUNCTION bump_ai_model_state_version() RETURNS trigger AS $$
+BEGIN
+    PERFORM nextval('ai_model_state_version');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS violation_markups_model_state ON violation_markups;
+CREATE TRIGGER violation_markups_model_state
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON violation_markups
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_ai_model_state_version();
+
+DROP TRIGGER IF EXISTS ai_training_metrics_model_state ON ai_training_metrics;
+CREATE TRIGGER ai_training_metrics_model_state
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ai_training_metrics
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_ai_model_state_version();
@@ -0,0 +1,2 @@
+-- Признаки для k-NN собираются из параметров нарушений по markup_id — без индекса это полный просмотр таблицы
+CREATE INDEX IF NOT EXISTS idx_violation_parameters_markup_id ON violation_parameters(markup_id);
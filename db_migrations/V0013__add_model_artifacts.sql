@@ -0,0 +1,4 @@
+-- Ключ артефакта обученной модели в хранилище моделей (MODEL_STORE_DIR); NULL — метрики без сохранённой модели
+ALTER TABLE ai_training_metrics ADD COLUMN IF NOT EXISTS artifact_key TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_ai_training_metrics_artifact ON ai_training_metrics(training_date DESC) WHERE artifact_key IS NOT NULL;
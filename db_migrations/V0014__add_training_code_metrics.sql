@@ -0,0 +1,2 @@
+-- Метрики кросс-валидации по каждому коду нарушения: {"код": {"precision", "recall", "f1_score", "support"}}
+ALTER TABLE ai_training_metrics ADD COLUMN IF NOT EXISTS code_metrics JSONB;
@@ -0,0 +1,7 @@
+-- Водяной знак обучающей выборки версии: максимальные updated_at и id учтённых разметок.
+-- Инкрементальное дообучение читает только разметки после него; base_version — версия, от которой дообучали
+ALTER TABLE ai_training_metrics ADD COLUMN IF NOT EXISTS base_version TEXT;
+ALTER TABLE ai_training_metrics ADD COLUMN IF NOT EXISTS watermark_updated_at TIMESTAMP;
+ALTER TABLE ai_training_metrics ADD COLUMN IF NOT EXISTS watermark_id INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_violation_markups_updated_at ON violation_markups(updated_at);
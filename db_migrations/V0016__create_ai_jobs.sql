@@ -0,0 +1,26 @@
+-- Очередь фоновых задач ai-training (обучение и пакетная обработка).
+-- Воркеры забирают задачи через FOR UPDATE SKIP LOCKED; locked_at — heartbeat, по истечении аренды задача
+-- считается брошенной и забирается снова; run_after откладывает повтор после ошибки (экспоненциальная задержка)
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL CHECK (kind IN ('train-model', 'batch-process')),
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+    payload JSONB NOT NULL DEFAULT '{}',
+    result JSONB,
+    error TEXT,
+    progress NUMERIC NOT NULL DEFAULT 0,
+    progress_message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by TEXT,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_queued ON ai_jobs(run_after, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_running ON ai_jobs(locked_at) WHERE status = 'running';
@@ -0,0 +1,50 @@
+-- Дельта-синхронизация по порядку коммитов вместо updated_at: каждая запись materials и material_tombstones
+-- помечается id своей транзакции (change_xid), водяной знак — xmin снимка читателя. Транзакции с id меньше xmin
+-- уже закоммичены, поэтому долгая транзакция не выпадает из дельты, сколько бы она ни шла
+ALTER TABLE materials ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE material_tombstones ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE OR REPLACE FUNCTION stamp_material_change_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS materials_change_xid ON materials;
+CREATE TRIGGER materials_change_xid
+    BEFORE INSERT OR UPDATE ON materials
+    FOR EACH ROW EXECUTE FUNCTION stamp_material_change_xid();
+
+DROP TRIGGER IF EXISTS material_tombstones_change_xid ON material_tombstones;
+CREATE TRIGGER material_tombstones_change_xid
+    BEFORE INSERT OR UPDATE ON material_tombstones
+    FOR EACH ROW EXECUTE FUNCTION stamp_material_change_xid();
+
+-- Повторно вставленный id больше не считается удалённым
+CREATE OR REPLACE FUNCTION clear_material_tombstones() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM material_tombstones t USING new_rows n WHERE t.id = n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS materials_clear_tombstones ON materials;
+CREATE TRIGGER materials_clear_tombstones
+    AFTER INSERT ON materials
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION clear_material_tombstones();
+
+DELETE FROM material_tombstones t USING materials m WHERE t.id = m.id;
+
+-- Граница очистки надгробий: дельта от водяного знака не новее pruned_xid неполна и требует полной перезагрузки,
+-- дообучение от водяного знака раньше pruned_before — полного обучения
+CREATE TABLE IF NOT EXISTS material_tombstone_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    pruned_xid xid8 NOT NULL,
+    pruned_before TIMESTAMP NOT NULL
+);
+
+DROP INDEX IF EXISTS idx_materials_updated_at;
+CREATE INDEX IF NOT EXISTS idx_materials_change_xid ON materials(change_xid, id);
+CREATE INDEX IF NOT EXISTS idx_material_tombstones_change_xid ON material_tombstones(change_xid, id);
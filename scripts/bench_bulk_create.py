@@ -0,0 +1,85 @@
+'''Сравнение скорости bulk_create: старый построчный цикл против чанкового многострочного upsert.
+
+Запуск: DATABASE_URL=... python scripts/bench_bulk_create.py --rows 5000 --chunk-size 500
+Все вставки выполняются в транзакции, которая откатывается в конце каждого прогона.
+'''
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'materials'))
+from index import bulk_upsert_materials
+
+def make_materials(count: int) -> list:
+    start = datetime(2026, 1, 1)
+    return [
+        {
+            'id': f'bench-{uuid.uuid4()}',
+            'fileName': f'camera_{i:06d}.tar',
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            'preview': f'https://example.com/previews/{i}.jpg',
+            'status': 'pending',
+            'violationType': None,
+            'violationCode': None
+        }
+        for i in range(count)
+    ]
+
+def legacy_loop(cursor, materials: list) -> None:
+    for material in materials:
+        cursor.execute('''
+            INSERT INTO t_p28865948_photo_material_proce.materials
+            (id, file_name, timestamp, preview_url, status, violation_type, violation_code)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET
+                status = EXCLUDED.status,
+                violation_code = EXCLUDED.violation_code,
+                violation_type = EXCLUDED.violation_type,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (
+            material['id'],
+            material['fileName'],
+            material.get('timestamp'),
+            material.get('preview'),
+            material.get('status', 'pending'),
+            material.get('violationType'),
+            material.get('violationCode')
+        ))
+
+def timed_run(conn, fn) -> float:
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    try:
+        fn(cursor)
+        return time.perf_counter() - started
+    finally:
+        conn.rollback()
+        cursor.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    materials = make_materials(args.rows)
+
+    runs = {
+        'legacy loop': lambda cur: legacy_loop(cur, materials),
+        f'chunked upsert ({args.chunk_size})': lambda cur: bulk_upsert_materials(cur, materials, args.chunk_size)
+    }
+    for name, fn in runs.items():
+        best = min(timed_run(conn, fn) for _ in range(args.repeat))
+        print(f'{name:<28} {args.rows / best:>12.0f} rows/sec  ({best:.3f}s best of {args.repeat})')
+
+    conn.close()
+
+if __name__ == '__main__':
+    main()
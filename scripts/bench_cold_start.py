@@ -0,0 +1,152 @@
+'''Бенчмарк холодного старта backend-функций.
+
+Каждый прогон — новый процесс интерпретатора с -X importtime: замеряется время до первого ответа handler'а
+(запуск процесса, импорт index.py, первый вызов) и разбивка времени импорта по модулям. По умолчанию
+handler вызывается с OPTIONS; с --scenario дополнительно выполняется первый сценарий функции из tests.json
+(нужен DATABASE_URL). При --budget-ms процесс завершается с кодом 1, если медиана времени от начала импорта
+index.py до ответа на OPTIONS превышает бюджет.
+
+Примеры:
+    python scripts/bench_cold_start.py --runs 10
+    DATABASE_URL=... python scripts/bench_cold_start.py --function materials --scenario --budget-ms 150
+'''
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gateway import BACKEND_DIR, discover_functions
+from bench_handlers import load_scenarios
+
+TRACKED_MODULES = ('psycopg2', 'psycopg2.extras', 'uuid', 'hashlib', 'datetime', 'secrets', 'brotli', 'PIL', 'numpy')
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+MARKER = '__cold_start__'
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {function_dir!r})
+import index
+imported = time.perf_counter()
+context = type('Context', (), {{'request_id': 'cold-start', 'function_name': {function!r}}})()
+timings = {{'importMs': (imported - started) * 1000}}
+for probe in {probes!r}:
+    probe_started = time.perf_counter()
+    response = index.handler(probe['event'], context)
+    timings[probe['name'] + 'Ms'] = (time.perf_counter() - probe_started) * 1000
+    timings[probe['name'] + 'Status'] = response.get('statusCode')
+print({marker!r} + json.dumps(timings))
+'''
+
+def probe_events(function: str, with_scenario: bool) -> list:
+    probes = [{'name': 'options', 'event': {'httpMethod': 'OPTIONS', 'headers': {}, 'queryStringParameters': {}, 'body': ''}}]
+    if with_scenario:
+        scenarios = load_scenarios([function])
+        if scenarios:
+            scenario = scenarios[0]
+            path, _, query = scenario['path'].partition('?')
+            probes.append({'name': 'scenario', 'event': {
+                'httpMethod': scenario['method'],
+                'headers': {'content-type': 'application/json'},
+                'queryStringParameters': dict(part.split('=', 1) for part in query.split('&') if '=' in part),
+                'body': json.dumps(scenario['body']) if scenario['body'] is not None else ''
+            }})
+    return probes
+
+def parse_importtime(stderr: str) -> dict:
+    '''Совокупное время импорта (мс) для каждого модуля из вывода -X importtime и признак прямого импорта из index.py.
+    Вывод идёт в обратном порядке обхода: дочерние модули печатаются перед родителем'''
+    modules = {}
+    children = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        name, depth = match.group(4), (len(match.group(3)) - 1) // 2
+        modules[name] = [int(match.group(2)) / 1000, False]
+        if depth == 1:
+            children.append(name)
+        elif depth == 0:
+            if name == 'index':
+                for child in children:
+                    modules[child][1] = True
+            children = []
+    return modules
+
+def run_once(function: str, probes: list) -> dict:
+    function_dir = os.path.abspath(os.path.join(BACKEND_DIR, function))
+    code = CHILD.format(function_dir=function_dir, function=function, probes=probes, marker=MARKER)
+    env = {**os.environ, 'TRACE_LOG': '0', 'PROFILE_DIR': ''}
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=function_dir, env=env, capture_output=True, text=True)
+    wall = (time.perf_counter() - started) * 1000
+    lines = [line for line in result.stdout.splitlines() if line.startswith(MARKER)]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f'{function}: cold start failed\n{result.stderr[-2000:]}')
+    timings = json.loads(lines[-1][len(MARKER):])
+    timings['processMs'] = wall
+    timings['modules'] = parse_importtime(result.stderr)
+    return timings
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--function', action='append', help='только указанные функции')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scenario', action='store_true', help='после OPTIONS выполнить первый сценарий из tests.json')
+    parser.add_argument('--top', type=int, default=8, help='сколько самых дорогих прямых импортов index.py показывать')
+    parser.add_argument('--budget-ms', type=float, help='бюджет медианы времени до первого ответа OPTIONS')
+    parser.add_argument('--json', help='сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    results = {}
+    over_budget = []
+    for function in args.function or discover_functions():
+        probes = probe_events(function, args.scenario)
+        runs = [run_once(function, probes) for _ in range(args.runs)]
+        median = lambda key: round(statistics.median(r[key] for r in runs), 2)
+        modules = {}
+        direct = set()
+        for run in runs:
+            for name, (ms, from_index) in run['modules'].items():
+                modules.setdefault(name, []).append(ms)
+                if from_index:
+                    direct.add(name)
+        module_medians = {name: round(statistics.median(values), 2) for name, values in modules.items()}
+        first_response = round(statistics.median(r['importMs'] + r['optionsMs'] for r in runs), 2)
+        results[function] = {
+            'processMs': median('processMs'),
+            'firstResponseMs': first_response,
+            'importIndexMs': median('importMs'),
+            'optionsMs': median('optionsMs'),
+            'scenarioMs': median('scenarioMs') if args.scenario and 'scenarioMs' in runs[0] else None,
+            'tracked': {name: module_medians.get(name) for name in TRACKED_MODULES},
+            'modules': dict(sorted(module_medians.items(), key=lambda item: item[1], reverse=True))
+        }
+        if args.budget_ms is not None and first_response > args.budget_ms:
+            over_budget.append(f'{function}: {first_response} ms > {args.budget_ms} ms')
+
+        row = results[function]
+        print(f"\n{function}: first response {row['firstResponseMs']} ms (import index {row['importIndexMs']} ms, "
+              f"OPTIONS {row['optionsMs']} ms), whole process {row['processMs']} ms" + (f", first scenario {row['scenarioMs']} ms" if row['scenarioMs'] is not None else ''))
+        print('  tracked: ' + ', '.join(f'{name}={ms if ms is not None else "not imported"}' for name, ms in row['tracked'].items()))
+        for name in sorted(direct, key=module_medians.get, reverse=True)[:args.top]:
+            print(f'  {name:<28}{module_medians[name]:>10} ms')
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if over_budget:
+        print('\nOver cold-start budget:')
+        for line in over_budget:
+            print(f'  {line}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+'''Нагрузочный бенчмарк backend-функций по сценариям из backend/*/tests.json.
+
+Сценарии (или пользовательская смесь --mix) прогоняются с заданной конкурентностью либо прямо через handler
+в текущем процессе, либо по HTTP через scripts/gateway.py. Для каждого action выводятся throughput и
+p50/p95/p99; результаты можно сохранить как baseline и сравнивать с ним, завершаясь с кодом 1 при регрессии.
+
+По умолчанию выполняются только читающие сценарии (GET/OPTIONS и list/search/stats материалов). Сценарии, меняющие
+данные (create, bulk_*, purge, migrate_previews, predict, проверки нарушений и т.п.), запускаются только с
+--allow-writes и только на базе, заполненной scripts/generate_dataset.py, а не на рабочей.
+
+Примеры:
+    DATABASE_URL=... python scripts/bench_handlers.py --requests 2000 --concurrency 16 --save-baseline bench/baseline.json
+    python scripts/bench_handlers.py --target http://localhost:8000 --baseline bench/baseline.json --threshold 0.2
+    python scripts/bench_handlers.py --mix bench/review_mix.json --include "materials/"
+    DATABASE_URL=... python scripts/bench_handlers.py --allow-writes --include "materials/bulk_create"
+
+Формат --mix: {"requests": [{"function": "materials", "scenario": "List materials", "weight": 5},
+                            {"function": "ai-training", "method": "GET", "path": "/?action=training-data", "weight": 1}]}
+Пользовательский запрос смеси считается меняющим данные, если не указано "readOnly": true.
+'''
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gateway import BACKEND_DIR, discover_functions, load_function, build_event
+
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+READ_ONLY_ACTIONS = ('materials/list', 'materials/search', 'materials/stats')
+
+def load_scenarios(functions: list) -> list:
+    scenarios = []
+    for function in functions:
+        path = os.path.join(BACKEND_DIR, function, 'tests.json')
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            for test in json.load(f)['tests']:
+                scenarios.append({
+                    'function': function,
+                    'name': test['name'],
+                    'method': test.get('method', 'GET'),
+                    'path': test.get('path', '/'),
+                    'body': test.get('body'),
+                    'expectedStatus': test.get('expectedStatus'),
+                    'readOnly': test.get('readOnly'),
+                    'weight': 1
+                })
+    return scenarios
+
+def load_mix(path: str, scenarios: list) -> list:
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)['requests']
+    by_name = {(s['function'], s['name']): s for s in scenarios}
+    mix = []
+    for entry in entries:
+        if 'scenario' in entry:
+            scenario = dict(by_name[(entry['function'], entry['scenario'])])
+        else:
+            scenario = {
+                'function': entry['function'],
+                'name': entry.get('name', f"{entry.get('method', 'GET')} {entry.get('path', '/')}"),
+                'method': entry.get('method', 'GET'),
+                'path': entry.get('path', '/'),
+                'body': entry.get('body'),
+                'expectedStatus': entry.get('expectedStatus'),
+                'readOnly': entry.get('readOnly', False)
+            }
+        scenario['weight'] = entry.get('weight', 1)
+        mix.append(scenario)
+    return mix
+
+def action_key(scenario: dict) -> str:
+    query = dict(parse_qsl(urlsplit(scenario['path']).query))
+    action = (scenario['body'] or {}).get('action') if isinstance(scenario['body'], dict) else None
+    action = action or query.get('action') or scenario['method']
+    return f"{scenario['function']}/{action}"
+
+def is_read_only(scenario: dict) -> bool:
+    if scenario.get('readOnly') is not None:
+        return bool(scenario['readOnly'])
+    return scenario['method'] in READ_ONLY_METHODS or action_key(scenario) in READ_ONLY_ACTIONS
+
+def select_scenarios(scenarios: list, allow_writes: bool) -> list:
+    '''Без allow_writes отбрасывает сценарии, меняющие данные; с ним — предупреждает, какие будут выполнены'''
+    writes = [s for s in scenarios if not is_read_only(s)]
+    if not allow_writes:
+        return [s for s in scenarios if is_read_only(s)]
+    if writes:
+        print(f'WARNING: {len(writes)} scenarios modify data in the target database: '
+              + ', '.join(sorted({action_key(s) for s in writes})), file=sys.stderr)
+    return scenarios
+
+def inproc_sender(functions: set):
+    handlers = {name: load_function(name) for name in functions}
+
+    def send(scenario: dict) -> int:
+        url = urlsplit(scenario['path'])
+        body = json.dumps(scenario['body']).encode() if scenario['body'] is not None else b''
+        headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip, br'}
+        event = build_event(scenario['method'], url.path, url.query, headers, body, '127.0.0.1')
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=scenario['function'])
+        return handlers[scenario['function']](event, context)['statusCode']
+    return send
+
+def http_sender(base_url: str):
+    def send(scenario: dict) -> int:
+        data = json.dumps(scenario['body']).encode() if scenario['body'] is not None else None
+        request = urllib.request.Request(
+            f"{base_url.rstrip('/')}/{scenario['function']}{scenario['path']}",
+            data=data,
+            method=scenario['method'],
+            headers={'Content-Type': 'application/json', 'Accept-Encoding': 'gzip, br'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return send
+
+def run(scenarios: list, send, total: int, concurrency: int, seed: int) -> tuple:
+    rng = random.Random(seed)
+    schedule = rng.choices(scenarios, weights=[s['weight'] for s in scenarios], k=total)
+    samples = []
+    lock = threading.Lock()
+
+    def one(scenario: dict) -> None:
+        started = time.perf_counter()
+        try:
+            status = send(scenario)
+            expected = scenario.get('expectedStatus')
+            ok = status == expected if expected else status < 500
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            samples.append((action_key(scenario), elapsed, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, schedule))
+    return samples, time.perf_counter() - started
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: list, wall_time: float) -> dict:
+    grouped = {}
+    for key, elapsed, ok in samples:
+        grouped.setdefault(key, []).append((elapsed, ok))
+    report = {}
+    for key, values in sorted(grouped.items()):
+        latencies = sorted(v[0] * 1000 for v in values)
+        report[key] = {
+            'count': len(values),
+            'errors': sum(1 for v in values if not v[1]),
+            'rps': round(len(values) / wall_time, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2)
+        }
+    return report
+
+def find_regressions(report: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    regressions = []
+    for key, current in report.items():
+        previous = baseline.get('actions', {}).get(key)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            delta = current[metric] - previous[metric]
+            if delta > min_delta_ms and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f'{key} {metric}: {previous[metric]} -> {current[metric]} ms')
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', default='inproc', help='inproc или базовый URL шлюза')
+    parser.add_argument('--function', action='append', help='только указанные функции')
+    parser.add_argument('--mix', help='JSON со смесью запросов и весами')
+    parser.add_argument('--include', help='регулярное выражение по "функция/action" или имени сценария')
+    parser.add_argument('--exclude', help='исключить сценарии по регулярному выражению')
+    parser.add_argument('--allow-writes', action='store_true', help='выполнять и сценарии, меняющие данные')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый относительный рост латентности')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='игнорировать рост меньше этого значения')
+    args = parser.parse_args()
+
+    functions = args.function or discover_functions()
+    scenarios = load_scenarios(functions)
+    if args.mix:
+        scenarios = load_mix(args.mix, scenarios)
+
+    def matches(pattern: str, scenario: dict) -> bool:
+        return bool(re.search(pattern, action_key(scenario)) or re.search(pattern, scenario['name']))
+    if args.include:
+        scenarios = [s for s in scenarios if matches(args.include, s)]
+    if args.exclude:
+        scenarios = [s for s in scenarios if not matches(args.exclude, s)]
+    scenarios = select_scenarios(scenarios, args.allow_writes)
+    if not scenarios:
+        sys.exit('No scenarios selected (data-modifying scenarios need --allow-writes)')
+
+    send = inproc_sender({s['function'] for s in scenarios}) if args.target == 'inproc' else http_sender(args.target)
+    samples, wall_time = run(scenarios, send, args.requests, args.concurrency, args.seed)
+    report = summarize(samples, wall_time)
+
+    print(f"{'action':<36}{'count':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for key, row in report.items():
+        print(f"{key:<36}{row['count']:>7}{row['errors']:>6}{row['rps']:>9}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+    result = {
+        'target': args.target,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'wallTime': round(wall_time, 3),
+        'actions': report
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print('\nRegressions over threshold:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+'''Проверка планов SQL-запросов handler'ов на синтетическом наборе данных.
+
+Сценарии backend/*/tests.json прогоняются через handler'ы в текущем процессе; каждый выполненный
+запрос перехватывается (уже с подставленными параметрами), затем для каждого уникального запроса
+снимается EXPLAIN (ANALYZE, BUFFERS) внутри транзакции с откатом. Отчёт помечает Seq Scan по большим
+таблицам и сравнивает форму плана (типы узлов, таблицы, индексы) с сохранённым снимком.
+
+По умолчанию, как и в bench_handlers.py, выполняются только читающие сценарии. С --allow-writes сценарии
+create/update/purge выполняются по-настоящему и меняют данные, поэтому запускайте их на базе, заполненной
+scripts/generate_dataset.py, а не на рабочей.
+
+Примеры:
+    DATABASE_URL=... python scripts/check_query_plans.py --save plans/baseline.json
+    DATABASE_URL=... python scripts/check_query_plans.py --baseline plans/baseline.json --allow-writes --exclude purge
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from gateway import discover_functions, load_function, build_event
+from bench_handlers import load_scenarios, action_key, select_scenarios
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+class Recorder:
+    '''Запросы, выполненные handler'ами, вместе с текущим action'''
+    recorded = []
+    current_action = None
+    cursor_classes = {}
+    connection_classes = {}
+
+def recording_cursor_class(factory):
+    cls = Recorder.cursor_classes.get(factory)
+    if cls is None:
+        def execute(self, query, vars=None):
+            Recorder.recorded.append((Recorder.current_action, self.mogrify(query, vars).decode('utf-8')))
+            return factory.execute(self, query, vars)
+        cls = type(f'Recording{factory.__name__}', (factory,), {'execute': execute})
+        Recorder.cursor_classes[factory] = cls
+    return cls
+
+def recording_connection_class(base):
+    '''Подмешивает запись запросов к фабрике соединений, которую передаёт db.py функции'''
+    cls = Recorder.connection_classes.get(base)
+    if cls is None:
+        def cursor(self, *args, **kwargs):
+            kwargs['cursor_factory'] = recording_cursor_class(kwargs.get('cursor_factory') or psycopg2.extensions.cursor)
+            return base.cursor(self, *args, **kwargs)
+        cls = type(f'Recording{base.__name__}', (base,), {'cursor': cursor})
+        Recorder.connection_classes[base] = cls
+    return cls
+
+def fingerprint(sql: str) -> str:
+    '''Нормализованный текст запроса: литералы заменены на ?, списки VALUES и IN свёрнуты'''
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    normalized = re.sub(r'\b\d+(?:\.\d+)?\b', '?', normalized)
+    normalized = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*', '(...)', normalized)
+    normalized = re.sub(r'ARRAY\[[^\]]*\]', 'ARRAY[...]', normalized)
+    return re.sub(r'\s+', ' ', normalized).strip()
+
+def collect_queries(scenarios: list) -> dict:
+    connect = psycopg2.connect
+
+    def recording_connect(dsn, connection_factory=None, **kwargs):
+        base = connection_factory or psycopg2.extensions.connection
+        return connect(dsn, connection_factory=recording_connection_class(base), **kwargs)
+    psycopg2.connect = recording_connect
+    try:
+        handlers = {name: load_function(name) for name in {s['function'] for s in scenarios}}
+        for scenario in scenarios:
+            Recorder.current_action = action_key(scenario)
+            url = urlsplit(scenario['path'])
+            body = json.dumps(scenario['body']).encode() if scenario['body'] is not None else b''
+            event = build_event(scenario['method'], url.path, url.query, {'Content-Type': 'application/json'}, body, '127.0.0.1')
+            context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=scenario['function'])
+            try:
+                handlers[scenario['function']](event, context)
+            except Exception as e:
+                print(f"  {scenario['function']}: {scenario['name']} failed: {e}", file=sys.stderr)
+    finally:
+        psycopg2.connect = connect
+
+    queries = {}
+    for action, sql in Recorder.recorded:
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        normalized = fingerprint(sql)
+        key = f'{action}#{hashlib.sha1(normalized.encode()).hexdigest()[:10]}'
+        queries.setdefault(key, {'action': action, 'fingerprint': normalized, 'sql': sql})
+    return queries
+
+def plan_shape(node: dict) -> list:
+    '''Форма плана в прямом обходе: тип узла, таблица, индекс'''
+    shape = [' '.join(filter(None, (node['Node Type'], node.get('Relation Name'), node.get('Index Name'))))]
+    for child in node.get('Plans', []):
+        shape.extend(plan_shape(child))
+    return shape
+
+def seq_scans(node: dict) -> list:
+    scans = [node['Relation Name']] if node['Node Type'] == 'Seq Scan' else []
+    for child in node.get('Plans', []):
+        scans.extend(seq_scans(child))
+    return scans
+
+def explain(conn, sql: str) -> dict:
+    cursor = conn.cursor()
+    try:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql)
+        return cursor.fetchone()[0][0]
+    finally:
+        cursor.close()
+        conn.rollback()
+
+def table_rows(conn, relation: str, cache: dict) -> float:
+    if relation not in cache:
+        cursor = conn.cursor()
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s ORDER BY reltuples DESC LIMIT 1', (relation,))
+        row = cursor.fetchone()
+        cursor.close()
+        conn.rollback()
+        cache[relation] = row[0] if row else 0
+    return cache[relation]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--function', action='append', help='только указанные функции')
+    parser.add_argument('--include', help='регулярное выражение по "функция/action" или имени сценария')
+    parser.add_argument('--exclude', help='исключить сценарии по регулярному выражению')
+    parser.add_argument('--allow-writes', action='store_true', help='выполнять и сценарии, меняющие данные')
+    parser.add_argument('--schema', default='t_p28865948_photo_material_proce')
+    parser.add_argument('--seq-scan-rows', type=float, default=10000, help='Seq Scan по таблицам больше этого числа строк считается проблемой')
+    parser.add_argument('--save', help='сохранить снимок планов в JSON')
+    parser.add_argument('--baseline', help='сравнить формы планов с сохранённым снимком')
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.function or discover_functions())
+
+    def matches(pattern: str, scenario: dict) -> bool:
+        return bool(re.search(pattern, action_key(scenario)) or re.search(pattern, scenario['name']))
+    if args.include:
+        scenarios = [s for s in scenarios if matches(args.include, s)]
+    if args.exclude:
+        scenarios = [s for s in scenarios if not matches(args.exclude, s)]
+    scenarios = select_scenarios(scenarios, args.allow_writes)
+    if not scenarios:
+        sys.exit('No scenarios selected (data-modifying scenarios need --allow-writes)')
+
+    queries = collect_queries(scenarios)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor()
+    cursor.execute(f'SET search_path TO {args.schema}, public')
+    cursor.close()
+    conn.commit()
+
+    sizes = {}
+    report = {}
+    problems = []
+    for key, query in sorted(queries.items()):
+        try:
+            plan = explain(conn, query['sql'])
+        except psycopg2.Error as e:
+            print(f'  {key}: EXPLAIN failed: {e.pgerror or e}', file=sys.stderr)
+            continue
+        root = plan['Plan']
+        large_scans = sorted({r for r in seq_scans(root) if table_rows(conn, r, sizes) > args.seq_scan_rows})
+        report[key] = {
+            'action': query['action'],
+            'fingerprint': query['fingerprint'],
+            'shape': plan_shape(root),
+            'executionMs': round(plan.get('Execution Time', 0.0), 3),
+            'sharedHitBlocks': root.get('Shared Hit Blocks', 0),
+            'sharedReadBlocks': root.get('Shared Read Blocks', 0),
+            'seqScans': large_scans
+        }
+        for relation in large_scans:
+            problems.append(f'{key} Seq Scan on {relation} (~{int(sizes[relation])} rows)')
+
+    print(f"{'query':<44}{'ms':>10}{'hit':>10}{'read':>10}  seq scans")
+    for key, row in report.items():
+        print(f"{key:<44}{row['executionMs']:>10}{row['sharedHitBlocks']:>10}{row['sharedReadBlocks']:>10}  {', '.join(row['seqScans'])}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['queries']
+        for key, row in report.items():
+            previous = baseline.get(key)
+            if previous and previous['shape'] != row['shape']:
+                problems.append(f"{key} plan changed: {' > '.join(previous['shape'])}  =>  {' > '.join(row['shape'])}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'seqScanRows': args.seq_scan_rows, 'queries': report}, f, indent=2, ensure_ascii=False)
+
+    conn.close()
+    if problems:
+        print('\nPlan problems:')
+        for line in problems:
+            print(f'  {line}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
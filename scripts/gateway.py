@@ -0,0 +1,366 @@
+'''Локальный HTTP-шлюз для функций backend/*/index.py.
+
+Каждая функция монтируется по маршруту /<имя-каталога>/ (например /materials/, /ai-training/?action=metrics),
+HTTP-запрос переводится в event того же вида, что передаёт облачная среда (httpMethod, queryStringParameters,
+headers, body, requestContext), а ответ handler'а — обратно в HTTP. Сводки трассировки handler'ов
+агрегируются и отдаются в текстовом формате Prometheus по GET /metrics; при --processes больше 1 каждый процесс
+раз в --metrics-interval секунд сбрасывает свои агрегаты в общий каталог, и /metrics суммирует все процессы.
+Файлы превью из BLOB_STORE_DIR (BLOB_STORE_BACKEND=local) отдаются по GET /blobs/<ключ>.
+
+Запуск:
+    DATABASE_URL=postgresql://... python scripts/gateway.py --port 8000 --processes 4 --threads 16
+'''
+import argparse
+import base64
+import importlib
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qsl
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', '/var/lib/trafficvision/blobs')
+
+def discover_functions(backend_dir: str = BACKEND_DIR) -> list:
+    return sorted(
+        name for name in os.listdir(backend_dir)
+        if os.path.isfile(os.path.join(backend_dir, name, 'index.py'))
+    )
+
+def load_function(name: str, backend_dir: str = BACKEND_DIR):
+    '''Импортирует index.py функции изолированно: у каждой функции свои db.py/response.py,
+    поэтому локальные модули убираются из sys.modules после загрузки'''
+    function_dir = os.path.abspath(os.path.join(backend_dir, name))
+    local_modules = [f[:-3] for f in os.listdir(function_dir) if f.endswith('.py')]
+    for module in local_modules:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, function_dir)
+    try:
+        module = importlib.import_module('index')
+    finally:
+        sys.path.remove(function_dir)
+        for local in local_modules:
+            sys.modules.pop(local, None)
+    return module.handler
+
+def build_event(method: str, path: str, query: str, headers, body: bytes, client_ip: str) -> dict:
+    try:
+        body_text = body.decode('utf-8')
+        is_base64 = False
+    except UnicodeDecodeError:
+        body_text = base64.b64encode(body).decode('ascii')
+        is_base64 = True
+    header_map = {key.lower(): value for key, value in headers.items()}
+    return {
+        'httpMethod': method,
+        'path': path,
+        'queryStringParameters': dict(parse_qsl(query, keep_blank_values=True)),
+        'headers': header_map,
+        'body': body_text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'httpMethod': method,
+            'identity': {
+                'sourceIp': client_ip,
+                'userAgent': header_map.get('user-agent', '')
+            }
+        }
+    }
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def label_string(labels: dict) -> str:
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"') for key, value in labels.items()}
+    return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+class Metrics:
+    '''Агрегаты по сводкам трассировки (context.on_trace) в формате Prometheus'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {}
+        self.phases = {}
+        self.queries = {}
+        self.version = 0
+        self.flush_lock = threading.Lock()
+        self.flushed_version = None
+        self.shared_dir = None
+
+    def observe(self, summary: dict) -> None:
+        key = (summary['function'], summary['action'])
+        seconds = summary['durationMs'] / 1000
+        with self.lock:
+            self.version += 1
+            status_key = key + (str(summary['status']),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            buckets, total, count = self.histograms.get(key, ([0] * len(LATENCY_BUCKETS), 0.0, 0))
+            buckets = [n + (seconds <= bound) for n, bound in zip(buckets, LATENCY_BUCKETS)]
+            self.histograms[key] = (buckets, total + seconds, count + 1)
+            for phase, ms in summary['phasesMs'].items():
+                phase_key = key + (phase,)
+                self.phases[phase_key] = self.phases.get(phase_key, 0.0) + ms / 1000
+            for query in summary['queries']:
+                query_key = (summary['function'], query['id'])
+                count_, seconds_, rows = self.queries.get(query_key, (0, 0.0, 0))
+                self.queries[query_key] = (count_ + query['count'], seconds_ + query['ms'] / 1000, rows + query['rows'])
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'requests': [[list(key), count] for key, count in self.requests.items()],
+                'histograms': [[list(key), value] for key, value in self.histograms.items()],
+                'phases': [[list(key), total] for key, total in self.phases.items()],
+                'queries': [[list(key), value] for key, value in self.queries.items()]
+            }
+
+    def merge(self, state: dict) -> None:
+        '''Прибавляет агрегаты другого процесса (формат snapshot)'''
+        with self.lock:
+            for key, count in state['requests']:
+                key = tuple(key)
+                self.requests[key] = self.requests.get(key, 0) + count
+            for key, (buckets, total, count) in state['histograms']:
+                key = tuple(key)
+                own = self.histograms.get(key, ([0] * len(LATENCY_BUCKETS), 0.0, 0))
+                self.histograms[key] = ([a + b for a, b in zip(own[0], buckets)], own[1] + total, own[2] + count)
+            for key, total in state['phases']:
+                key = tuple(key)
+                self.phases[key] = self.phases.get(key, 0.0) + total
+            for key, values in state['queries']:
+                key = tuple(key)
+                own = self.queries.get(key, (0, 0.0, 0))
+                self.queries[key] = tuple(a + b for a, b in zip(own, values))
+
+    def share(self, directory: str, interval: float) -> None:
+        '''Вызывается в каждом процессе после fork: агрегаты процесса периодически пишутся в directory/<pid>.json'''
+        self.shared_dir = directory
+        threading.Thread(target=self.flush_loop, args=(interval,), daemon=True).start()
+
+    def flush(self) -> None:
+        '''Сбрасывает агрегаты процесса, если они изменились; ошибки записи не мешают обслуживанию запросов'''
+        with self.flush_lock:
+            version = self.version
+            if version == self.flushed_version:
+                return
+            path = os.path.join(self.shared_dir, f'{os.getpid()}.json')
+            try:
+                with open(f'{path}.tmp', 'w') as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(f'{path}.tmp', path)
+            except OSError:
+                return
+            self.flushed_version = version
+
+    def flush_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def collect(self) -> 'Metrics':
+        '''Агрегаты всех процессов шлюза: свои — актуальные, чужие — на момент их последнего сброса'''
+        if self.shared_dir is None:
+            return self
+        self.flush()
+        total = Metrics()
+        for name in os.listdir(self.shared_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, name)) as f:
+                    total.merge(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return total
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            lines.append('# TYPE handler_requests_total counter')
+            for (function, action, status), count in sorted(self.requests.items()):
+                lines.append(f'handler_requests_total{{{label_string({"function": function, "action": action, "status": status})}}} {count}')
+            lines.append('# TYPE handler_request_duration_seconds histogram')
+            for (function, action), (buckets, total, count) in sorted(self.histograms.items()):
+                labels = label_string({'function': function, 'action': action})
+                for bound, n in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'handler_request_duration_seconds_bucket{{{labels},le="{bound}"}} {n}')
+                lines.append(f'handler_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'handler_request_duration_seconds_sum{{{labels}}} {total:.6f}')
+                lines.append(f'handler_request_duration_seconds_count{{{labels}}} {count}')
+            lines.append('# TYPE handler_phase_seconds_total counter')
+            for (function, action, phase), total in sorted(self.phases.items()):
+                lines.append(f'handler_phase_seconds_total{{{label_string({"function": function, "action": action, "phase": phase})}}} {total:.6f}')
+            for index, name in enumerate(('handler_sql_queries_total', 'handler_sql_seconds_total', 'handler_sql_rows_total')):
+                lines.append(f'# TYPE {name} counter')
+                for (function, query), values in sorted(self.queries.items()):
+                    value = f'{values[index]:.6f}' if isinstance(values[index], float) else values[index]
+                    lines.append(f'{name}{{{label_string({"function": function, "query": query})}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    functions = {}
+    metrics = Metrics()
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_HEAD(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def do_OPTIONS(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics' and self.command == 'GET':
+            self.send_raw(200, {'Content-Type': 'text/plain; version=0.0.4'}, self.metrics.collect().render().encode('utf-8'))
+            return
+        parts = url.path.strip('/').split('/', 1)
+        if parts[0] == 'blobs' and self.command in ('GET', 'HEAD'):
+            self.send_blob(parts[1] if len(parts) > 1 else '')
+            return
+        handler = self.functions.get(parts[0])
+        if handler is None:
+            self.send_raw(404, {'Content-Type': 'application/json'}, b'{"error": "Unknown function"}')
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        event = build_event(self.command, '/' + (parts[1] if len(parts) > 1 else ''), url.query, self.headers, body, self.client_address[0])
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=parts[0], on_trace=self.metrics.observe)
+
+        try:
+            response = handler(event, context)
+        except Exception as e:
+            self.send_raw(502, {'Content-Type': 'application/json'}, f'{{"error": "Handler crashed: {type(e).__name__}"}}'.encode())
+            return
+
+        payload = response.get('body') or ''
+        data = base64.b64decode(payload) if response.get('isBase64Encoded') else payload.encode('utf-8')
+        self.send_raw(response.get('statusCode', 200), response.get('headers') or {}, data)
+
+    def send_blob(self, key: str):
+        '''Контентно-адресуемые файлы не меняются, поэтому кешируются без ограничения срока'''
+        root = os.path.realpath(BLOB_STORE_DIR)
+        path = os.path.realpath(os.path.join(root, key))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self.send_raw(404, {'Content-Type': 'application/json'}, b'{"error": "Blob not found"}')
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_raw(200, {
+            'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'Access-Control-Allow-Origin': '*'
+        }, data)
+
+    def send_raw(self, status: int, headers: dict, data: bytes):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, str(value))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class PooledHTTPServer(HTTPServer):
+    '''HTTP-сервер, обрабатывающий соединения в ограниченном пуле потоков'''
+    allow_reuse_address = True
+
+    def __init__(self, address, handler_class, threads: int, quiet: bool, bind_and_activate: bool = True):
+        super().__init__(address, handler_class, bind_and_activate)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.quiet = quiet
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+def serve(server: PooledHTTPServer) -> None:
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--processes', type=int, default=1, help='число процессов, разделяющих один сокет')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на процесс')
+    parser.add_argument('--metrics-interval', type=float, default=1.0, help='как часто процессы сбрасывают метрики, с')
+    parser.add_argument('--function', action='append', help='монтировать только указанные функции')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    names = args.function or discover_functions()
+    GatewayHandler.functions = {name: load_function(name) for name in names}
+
+    server = PooledHTTPServer((args.host, args.port), GatewayHandler, args.threads, args.quiet)
+    print(f'Gateway on http://{args.host}:{args.port} ({args.processes}x{args.threads} workers): ' + ', '.join(f'/{n}/' for n in names) + ', /metrics', flush=True)
+
+    metrics_dir = tempfile.mkdtemp(prefix='gateway-metrics-') if args.processes > 1 else None
+    children = []
+    for _ in range(args.processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            GatewayHandler.metrics.share(metrics_dir, args.metrics_interval)
+            serve(server)
+            os._exit(0)
+        children.append(pid)
+
+    if metrics_dir:
+        GatewayHandler.metrics.share(metrics_dir, args.metrics_interval)
+    # SIGTERM (docker stop) завершает родителя так же, как Ctrl+C: потомки останавливаются, каталог метрик удаляется
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(server)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
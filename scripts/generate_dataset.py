@@ -0,0 +1,203 @@
+'''Генератор синтетического набора данных промышленного объёма для схемы из db_migrations.
+
+Заполняет materials, markup_regions, violation_markups, violation_parameters, ai_training_data, ai_feedback
+и login_logs через COPY с правдоподобными распределениями (статусы, частоты кодов нарушений по Ципфу,
+суточный цикл камер). Идентификаторы SERIAL-таблиц резервируются от текущего максимума, поэтому
+генератор нельзя запускать параллельно с живой записью в эти таблицы.
+
+Запуск:
+    DATABASE_URL=... python scripts/generate_dataset.py --materials 500000 --days 90 --seed 7
+'''
+import argparse
+import hashlib
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+
+STATUSES = (('pending', 50), ('clean', 25), ('violation', 15), ('processed', 7), ('analytics', 3))
+VIOLATION_CODES = (
+    ('12.9.2', 'Превышение скорости на 20-40 км/ч'),
+    ('12.12.1', 'Проезд на запрещающий сигнал светофора'),
+    ('12.6', 'Непристёгнутый ремень безопасности'),
+    ('12.16.1', 'Несоблюдение требований дорожных знаков'),
+    ('12.9.3', 'Превышение скорости на 40-60 км/ч'),
+    ('12.15.1', 'Нарушение правил расположения ТС'),
+    ('12.20', 'Нарушение правил применения световых приборов'),
+    ('12.9.4', 'Превышение скорости на 60-80 км/ч')
+)
+REGION_TYPES = (('vehicle', 40), ('plate', 30), ('signal', 8), ('sign', 8), ('seatbelt', 6), ('headlight', 4), ('other', 4))
+PARAMETERS = ('speed', 'speed_limit', 'lane', 'signal_phase', 'direction')
+
+class CopySource(io.TextIOBase):
+    '''Файлоподобный источник для copy_expert, лениво читающий строки из генератора'''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.rows)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self.buffer = self.buffer, ''
+        else:
+            chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    readline = read
+
+def tsv(*values) -> str:
+    out = []
+    for value in values:
+        if value is None:
+            out.append('\\N')
+        else:
+            out.append(str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n'))
+    return '\t'.join(out) + '\n'
+
+def weighted(rng: random.Random, choices: tuple) -> str:
+    return rng.choices([c[0] for c in choices], weights=[c[1] for c in choices])[0]
+
+def zipf_code(rng: random.Random) -> tuple:
+    weights = [1 / (rank + 1) ** 1.2 for rank in range(len(VIOLATION_CODES))]
+    return rng.choices(VIOLATION_CODES, weights=weights)[0]
+
+def camera_timestamp(rng: random.Random, start: datetime, days: int) -> datetime:
+    day = rng.randrange(days)
+    hour = min(23, max(0, int(rng.gauss(14, 4.5))))
+    return start + timedelta(days=day, hours=hour, seconds=rng.randrange(3600))
+
+def next_id(cursor, table: str) -> int:
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+    return cursor.fetchone()[0]
+
+def reserve_sequence(cursor, table: str, last_id: int) -> None:
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), %s)", (max(last_id, 1),))
+
+def copy(cursor, table: str, columns: tuple, rows) -> None:
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", CopySource(rows))
+
+def generate(conn, args) -> dict:
+    rng = random.Random(args.seed)
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=args.days)
+    run_id = f'{args.seed}-{int(time.time())}'
+    cursor = conn.cursor()
+    cursor.execute(f'SET search_path TO {args.schema}, public')
+
+    materials = []
+    for i in range(args.materials):
+        status = weighted(rng, STATUSES)
+        code = zipf_code(rng) if status in ('violation', 'processed') or rng.random() < 0.2 else None
+        materials.append((f'synthetic-{run_id}-{i:08d}', camera_timestamp(rng, start, args.days), status, code))
+
+    def material_rows():
+        for material_id, timestamp, status, code in materials:
+            digest = hashlib.sha256(material_id.encode()).hexdigest()
+            yield tsv(
+                material_id, f'cam{rng.randrange(1, 400):03d}_{timestamp:%Y%m%d_%H%M%S}.tar', timestamp,
+                f'/blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg', digest, f'/blobs/{digest[:2]}/{digest[2:4]}/{digest}_thumb.jpg',
+                status, code[1] if code else None, code[0] if code else None, timestamp, timestamp
+            )
+    copy(cursor, 'materials', ('id', 'file_name', 'timestamp', 'preview_url', 'preview_hash', 'thumbnail_url',
+                               'status', 'violation_type', 'violation_code', 'created_at', 'updated_at'), material_rows())
+
+    counts = {'materials': len(materials), 'markup_regions': 0, 'violation_markups': 0,
+              'violation_parameters': 0, 'ai_training_data': 0, 'ai_feedback': 0, 'login_logs': 0}
+
+    def region_rows():
+        for material_id, timestamp, status, _ in materials:
+            for n in range(min(6, int(rng.expovariate(0.6)))):
+                counts['markup_regions'] += 1
+                width, height = rng.uniform(0.05, 0.5), rng.uniform(0.05, 0.4)
+                yield tsv(f'{material_id}-r{n}', material_id, round(rng.uniform(0, 1 - width), 4), round(rng.uniform(0, 1 - height), 4),
+                          round(width, 4), round(height, 4), '', weighted(rng, REGION_TYPES), timestamp)
+    copy(cursor, 'markup_regions', ('id', 'material_id', 'x', 'y', 'width', 'height', 'label', 'region_type', 'created_at'), region_rows())
+
+    markup_id = next_id(cursor, 'violation_markups')
+    markups = []
+    for material_id, timestamp, status, code in materials:
+        if status != 'pending' and rng.random() < 0.8:
+            markups.append((markup_id, material_id, timestamp, code or zipf_code(rng)))
+            markup_id += 1
+
+    def markup_rows():
+        for mid, material_id, timestamp, code in markups:
+            yield tsv(mid, material_id, code[0], code[1], round(rng.uniform(0.5, 0.99), 3),
+                      rng.random() < 0.6, f'operator{rng.randrange(1, 25)}', timestamp, timestamp)
+    copy(cursor, 'violation_markups', ('id', 'material_id', 'violation_code', 'notes', 'confidence', 'is_training_data',
+                                       'marked_by', 'created_at', 'updated_at'), markup_rows())
+    reserve_sequence(cursor, 'violation_markups', markup_id - 1)
+    counts['violation_markups'] = len(markups)
+
+    def parameter_rows():
+        for mid, _, timestamp, _ in markups:
+            for name in rng.sample(PARAMETERS, rng.randrange(0, 4)):
+                counts['violation_parameters'] += 1
+                yield tsv(mid, name, name, rng.randrange(20, 140), timestamp)
+    copy(cursor, 'violation_parameters', ('markup_id', 'parameter_id', 'parameter_name', 'value', 'created_at'), parameter_rows())
+
+    def training_rows():
+        for mid, material_id, timestamp, code in markups:
+            if rng.random() < 0.5:
+                counts['ai_training_data'] += 1
+                predicted = code if rng.random() < 0.85 else zipf_code(rng)
+                is_correct = predicted == code if rng.random() < 0.7 else None
+                yield tsv(material_id, mid, f'v{timestamp:%Y%m%d}', '{"source": "synthetic"}', predicted[0],
+                          code[0] if is_correct is not None else None, is_correct, timestamp)
+    copy(cursor, 'ai_training_data', ('material_id', 'markup_id', 'model_version', 'features', 'prediction_result',
+                                      'actual_result', 'is_correct', 'created_at'), training_rows())
+
+    def feedback_rows():
+        for mid, material_id, timestamp, code in markups:
+            if rng.random() < 0.35:
+                counts['ai_feedback'] += 1
+                predicted = code if rng.random() < 0.85 else zipf_code(rng)
+                yield tsv(material_id, predicted == code, timestamp, f'v{timestamp:%Y%m%d}', predicted[0], code[0], timestamp)
+    copy(cursor, 'ai_feedback', ('material_id', 'is_correct', 'feedback_date', 'model_version', 'predicted_code',
+                                 'actual_code', 'created_at'), feedback_rows())
+
+    def login_rows():
+        for _ in range(max(1, args.materials // 10)):
+            counts['login_logs'] += 1
+            success = rng.random() < 0.9
+            yield tsv(None if not success else rng.randrange(1, 50), f'operator{rng.randrange(1, 50)}@trafficvision.local',
+                      camera_timestamp(rng, start, args.days), f'10.0.{rng.randrange(256)}.{rng.randrange(256)}',
+                      'Mozilla/5.0', success, None if success else 'Неверный email или пароль')
+    copy(cursor, 'login_logs', ('user_id', 'email', 'login_time', 'ip_address', 'user_agent', 'success', 'failure_reason'), login_rows())
+
+    conn.commit()
+    conn.autocommit = True
+    for table in counts:
+        cursor.execute(f'ANALYZE {table}')
+    cursor.close()
+    return counts
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--materials', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--schema', default='t_p28865948_photo_material_proce')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    started = time.perf_counter()
+    counts = generate(conn, args)
+    conn.close()
+    elapsed = time.perf_counter() - started
+    for table, count in counts.items():
+        print(f'{table:<22}{count:>12}')
+    print(f'{"seconds":<22}{elapsed:>12.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+'''Серверная загрузка TAR-архивов с камер в таблицу materials.
+
+Архивы читаются потоково (tarfile, режим r|*), разбор и сохранение изображений идут в пуле процессов,
+результаты пакетами записываются через тот же upsert, что и action bulk_create.
+
+Запуск:
+    DATABASE_URL=... python scripts/ingest_tars.py /data/camera/2026-01-19 --codes violation_codes.json --workers 8
+
+Файл --codes содержит коды нарушений в формате настроек фронтенда: [{"code": "12.9.2", "description": "...", "xmlTag": "..."}].
+'''
+import argparse
+import json
+import os
+import re
+import sys
+import tarfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'materials'))
+from blob_store import get_blob_store, store_blob
+from index import bulk_upsert_materials, BULK_CHUNK_SIZE
+
+DIRECTION_MARKER = '<nDirection>1</nDirection>'
+NEXT_FLAG_RE = re.compile(r'<([^>\s/]+)[^>]*>\s*1\s*</\1>', re.IGNORECASE)
+TIMESTAMP_RE = re.compile(r'<timestamp>([^<]+)</timestamp>', re.IGNORECASE)
+
+def parse_targetinfo(text: str, tag_codes: dict) -> tuple:
+    '''То же правило, что в src/utils/tarParser.ts: первый тег со значением 1 после <nDirection>1</nDirection>.
+    Если XML-файлов в архиве несколько, как и во фронтенде, побеждает последний найденный код и timestamp'''
+    violation_code = None
+    direction_index = text.find(DIRECTION_MARKER)
+    if direction_index != -1 and tag_codes:
+        match = NEXT_FLAG_RE.search(text, direction_index + len(DIRECTION_MARKER))
+        if match:
+            violation_code = tag_codes.get(match.group(1).strip().lower())
+
+    time_match = TIMESTAMP_RE.search(text)
+    timestamp = time_match.group(1) if time_match else None
+    return violation_code, timestamp
+
+def image_role(name: str):
+    '''Только изображения, из которых берётся превью материала: коллаж, иначе общий кадр'''
+    name = os.path.basename(name).lower()
+    if not (name.endswith('.jpg') or name.endswith('.jpeg')):
+        return None
+    if '_0.jpg' in name:
+        return 'collage'
+    if name.endswith('.jpg') and '_' not in name:
+        return 'general'
+    return None
+
+def material_id(path: str) -> str:
+    '''Стабильный id по полному пути архива: одноимённые архивы из разных каталогов не перезаписывают друг друга'''
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'tar:{os.path.realpath(path)}'))
+
+def parse_archive(path: str, tag_codes: dict, descriptions: dict) -> dict:
+    '''Выполняется в процессе пула; возвращает материал в формате bulk_create'''
+    file_name = os.path.basename(path)
+    violation_code = None
+    timestamp = None
+    images = {}
+
+    try:
+        with tarfile.open(path, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if member.name.endswith('.xml') or 'targetinfo' in member.name:
+                    text = archive.extractfile(member).read().decode('utf-8', errors='replace')
+                    code, xml_timestamp = parse_targetinfo(text, tag_codes)
+                    violation_code = code or violation_code
+                    timestamp = xml_timestamp or timestamp
+                    continue
+                role = image_role(member.name)
+                if role:
+                    images[role] = archive.extractfile(member).read()
+        data = images.get('collage') or images.get('general')
+        preview = store_blob(data, 'image/jpeg', get_blob_store()) if data else {}
+    except (tarfile.TarError, OSError) as e:
+        return {'id': None, 'fileName': file_name, 'error': str(e)}
+
+    return {
+        'id': material_id(path),
+        'fileName': file_name,
+        'timestamp': timestamp or datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+        'preview': preview.get('preview_url'),
+        'previewHash': preview.get('preview_hash'),
+        'thumbnail': preview.get('thumbnail_url'),
+        'status': 'pending',
+        'violationCode': violation_code,
+        'violationType': descriptions.get(violation_code)
+    }
+
+def parse_archive_job(job: tuple) -> dict:
+    return parse_archive(*job)
+
+def collect_paths(inputs: list) -> list:
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.tar'))
+        else:
+            paths.append(item)
+    return paths
+
+def load_codes(path: str) -> tuple:
+    if not path:
+        return {}, {}
+    with open(path, encoding='utf-8') as f:
+        codes = json.load(f)
+    tag_codes = {c['xmlTag'].lower(): c['code'] for c in codes if c.get('xmlTag')}
+    descriptions = {c['code']: c.get('description') for c in codes}
+    return tag_codes, descriptions
+
+def flush(conn, batch: list, chunk_size: int, totals: dict) -> None:
+    cursor = conn.cursor()
+    try:
+        results = bulk_upsert_materials(cursor, batch, chunk_size)
+        conn.commit()
+    finally:
+        cursor.close()
+    for result in results:
+        totals[result['outcome']] = totals.get(result['outcome'], 0) + 1
+        if result['outcome'] == 'rejected':
+            print(f"rejected {result['id']}: {result['reason']}", file=sys.stderr)
+    batch.clear()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='TAR-архивы или каталоги с ними')
+    parser.add_argument('--codes', help='JSON с кодами нарушений и их XML-тегами')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=500, help='материалов на одну транзакцию')
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args()
+    if get_blob_store() is None:
+        parser.error('изображения архивов сохраняются файлами: задайте BLOB_STORE_BACKEND=local и BLOB_STORE_DIR')
+
+    tag_codes, descriptions = load_codes(args.codes)
+    paths = collect_paths(args.inputs)
+    jobs = ((path, tag_codes, descriptions) for path in paths)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    totals = {}
+    batch = []
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for material in pool.map(parse_archive_job, jobs, chunksize=16):
+            if material.get('error'):
+                totals['failed'] = totals.get('failed', 0) + 1
+                print(f"failed {material['fileName']}: {material['error']}", file=sys.stderr)
+                continue
+            batch.append(material)
+            if len(batch) >= args.batch_size:
+                flush(conn, batch, args.chunk_size, totals)
+
+    if batch:
+        flush(conn, batch, args.chunk_size, totals)
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'archives': len(paths),
+        'seconds': round(elapsed, 2),
+        'archivesPerSecond': round(len(paths) / elapsed, 1) if elapsed else None,
+        **totals
+    }, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
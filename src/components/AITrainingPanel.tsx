@@ -30,6 +30,9 @@ interface TrainingDataItem {
   preview_url?: string;
 }
 
+const TRAINING_POLL_INTERVAL_MS = 2000;
+const TRAINING_POLL_TIMEOUT_MS = 30 * 60 * 1000;
+
 interface AITrainingPanelProps {
   isOpen: boolean;
   onClose: () => void;
@@ -43,6 +46,8 @@ const AITrainingPanel = ({ isOpen, onClose, violationCodes, onAutoProcessToggle
   const [datasetStats, setDatasetStats] = useState<any>(null);
   const [isTraining, setIsTraining] = useState(false);
   const [trainingProgress, setTrainingProgress] = useState(0);
+  const [trainingMessage, setTrainingMessage] = useState<string | null>(null);
+  const [trainingError, setTrainingError] = useState<string | null>(null);
   const [activeTab, setActiveTab] = useState<'training' | 'samples'>('training');
   const [isUploading, setIsUploading] = useState(false);
   const [selectedSampleForMarkup, setSelectedSampleForMarkup] = useState<TrainingDataItem | null>(null);
@@ -89,10 +94,8 @@ const AITrainingPanel = ({ isOpen, onClose, violationCodes, onAutoProcessToggle
 
     setIsTraining(true);
     setTrainingProgress(0);
-
-    const progressInterval = setInterval(() => {
-      setTrainingProgress(prev => Math.min(prev + 10, 90));
-    }, 500);
+    setTrainingMessage('В очереди');
+    setTrainingError(null);
 
     try {
       const response = await fetch('https://functions.poehali.dev/f988916a-a0b1-4821-8408-f7732ad49548', {
@@ -101,25 +104,51 @@ const AITrainingPanel = ({ isOpen, onClose, violationCodes, onAutoProcessToggle
         body: JSON.stringify({ action: 'train-model' })
       });
 
-      clearInterval(progressInterval);
-      setTrainingProgress(100);
-
       const data = await response.json();
-      
-      if (response.ok) {
-        alert(`✅ Модель успешно переобучена!\n\nВерсия: ${data.model_version}\nТочность: ${(data.metrics.accuracy * 100).toFixed(2)}%\nОбразцов: ${data.training_samples}\n\nМетрики:\n• Precision: ${(data.metrics.precision * 100).toFixed(2)}%\n• Recall: ${(data.metrics.recall * 100).toFixed(2)}%\n• F1-Score: ${(data.metrics.f1_score * 100).toFixed(2)}%`);
+
+      if (!response.ok) {
+        setTrainingError(`${data.error}${data.message ? `: ${data.message}` : ''}`);
+        return;
+      }
+
+      const deadline = Date.now() + TRAINING_POLL_TIMEOUT_MS;
+      let job = data.job;
+      while (job.status === 'queued' || job.status === 'running') {
+        if (Date.now() > deadline) {
+          setTrainingError(job.status === 'queued'
+            ? `Задача #${data.job_id} не начала выполняться за ${TRAINING_POLL_TIMEOUT_MS / 60000} минут: проверьте, что запущен воркер ai-training`
+            : `Задача #${data.job_id} выполняется дольше ${TRAINING_POLL_TIMEOUT_MS / 60000} минут; результат появится в истории обучения`);
+          return;
+        }
+        await new Promise(resolve => setTimeout(resolve, TRAINING_POLL_INTERVAL_MS));
+        const statusResponse = await fetch(`https://functions.poehali.dev/f988916a-a0b1-4821-8408-f7732ad49548?action=job-status&job_id=${data.job_id}`);
+        const statusData = await statusResponse.json();
+        if (!statusResponse.ok || !statusData.job) {
+          setTrainingError(`Не удалось получить статус задачи #${data.job_id}: ${statusData.error || statusResponse.status}`);
+          return;
+        }
+        job = statusData.job;
+        setTrainingProgress(Math.round(job.progress * 100));
+        setTrainingMessage(job.status === 'queued' ? 'В очереди' : job.progress_message);
+      }
+
+      if (job.status === 'succeeded') {
+        const result = job.result;
+        alert(`✅ Модель успешно переобучена!\n\nВерсия: ${result.model_version}\nТочность: ${(result.metrics.accuracy * 100).toFixed(2)}%\nОбразцов: ${result.training_samples}\n\nМетрики:\n• Precision: ${(result.metrics.precision * 100).toFixed(2)}%\n• Recall: ${(result.metrics.recall * 100).toFixed(2)}%\n• F1-Score: ${(result.metrics.f1_score * 100).toFixed(2)}%`);
         await loadMetrics();
         await loadDatasetStats();
+      } else if (job.status === 'cancelled') {
+        alert('⚠️ Обучение отменено');
       } else {
-        alert(`❌ Ошибка обучения: ${data.error}\n${data.message || ''}`);
+        setTrainingError(`${job.error}${job.result?.message ? `: ${job.result.message}` : ''}`);
       }
     } catch (error) {
       console.error('Ошибка обучения модели:', error);
-      alert('❌ Ошибка обучения модели');
-      clearInterval(progressInterval);
+      setTrainingError('Ошибка обучения модели');
     } finally {
       setIsTraining(false);
       setTrainingProgress(0);
+      setTrainingMessage(null);
     }
   };
 
@@ -274,11 +303,18 @@ const AITrainingPanel = ({ isOpen, onClose, violationCodes, onAutoProcessToggle
                   <div className="space-y-2">
                     <Progress value={trainingProgress} className="h-2" />
                     <p className="text-sm text-slate-400 text-center">
-                      Обучение модели: {trainingProgress}%
+                      Обучение модели: {trainingProgress}%{trainingMessage ? ` — ${trainingMessage}` : ''}
                     </p>
                   </div>
                 )}
 
+                {!isTraining && trainingError && (
+                  <div className="flex items-start gap-2 text-sm text-red-400 bg-red-500/10 border border-red-500/30 rounded p-3 mb-3">
+                    <Icon name="XCircle" size={16} className="mt-0.5 flex-shrink-0" />
+                    <p>Ошибка обучения: {trainingError}</p>
+                  </div>
+                )}
+
                 {!isTraining && (datasetStats?.training_samples || 0) < 10 && (
                   <div className="flex items-start gap-2 text-sm text-amber-400 bg-amber-500/10 border border-amber-500/30 rounded p-3">
                     <Icon name="AlertTriangle" size={16} className="mt-0.5 flex-shrink-0" />